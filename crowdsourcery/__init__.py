@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Crowdsourcery
+
+Submodules are imported on first attribute access, so importing the package itself is
+cheap and ``crowdsourcery.viz`` only pulls in matplotlib when it is actually used.
+"""
+import importlib
+
+_SUBMODULES = {
+    'amt_client',
+    'benchmarks',
+    'config',
+    'cost',
+    'creation',
+    'html_hit',
+    'log',
+    'management',
+    'metrics',
+    'qualifications',
+    'rate_limit',
+    'rendering',
+    'serialize',
+    'storage',
+    'store',
+    'trace',
+    'utils',
+    'viz',
+    'workers',
+}
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | _SUBMODULES)
@@ -2,207 +2,586 @@
 """ AMT Client Interaction
 
 """
+import itertools
 import queue
 import threading
 import abc
+import time
 import boto3
 from decorator import decorator
+from botocore.config import Config as BotoConfig
 from botocore.exceptions import ClientError
 from tqdm import tqdm
 from .config import configure
+from .metrics import MetricsCollector
+from .rate_limit import (
+    backoff_delay,
+    get_rate_limiter,
+    is_throttling_error
+)
+from .trace import (
+    open_trace,
+    trace_call
+)
+
+_STOP_WORKER = None
 
 
 @decorator
 @configure
 def amt_multi_action(amt_action, *args, **kwargs):
-    client_config = kwargs['configuration']['amt_client_params']
-    n_threads = client_config['n_threads']
+    configs = kwargs['configuration']
+    client_config = configs['amt_client_params']
     action_name, hit_batch = amt_action(*args, **kwargs)
-    amt_action = globals().get(action_name)
-    hit_batches = [hit_batch[i::n_threads] for i in range(n_threads)]
-    threads = []
-    res_queue = queue.Queue()
-    for batch in hit_batches:
-        thread = amt_action(batch, res_queue, **client_config, **kwargs)
-        threads.append(thread)
-        thread.start()
-    for thread in threads:
-        thread.join()
-    result_list = []
-    while not res_queue.empty():
-        result_list.append(res_queue.get())
-    resp = [item for sub_l in result_list for item in sub_l]
+    operation = globals().get(action_name)
+    metrics = MetricsCollector(action_name)
+    with _open_dead_letters(action_name, configs) as dead_letters, open_trace(action_name, configs) as trace:
+        responses = stream_operation(operation, hit_batch, dead_letters=dead_letters, metrics=metrics,
+                                     trace=trace, **client_config, **kwargs)
+        results = list(responses)
+    resp = [res for _, res in results]
+    n_requested = len(resp)
+    metrics.finish(n_requested)
     resp = list(filter(None, resp))
-    print('\n' * (n_threads - 1))
     from .log import logger
-    logger.info('performed %s/%s %s actions', len(resp), len(hit_batch), action_name)
+    logger.info('performed %s/%s %s actions', len(resp), n_requested, action_name)
+    _log_request_rate(**client_config)
+    _log_dead_letters(dead_letters)
+    _report_metrics(metrics, configs)
+    from .store import record_action
+    record_action(action_name, hit_batch, results, **kwargs)
     return resp
 
 
+def stream_operation(operation, batch, **kwargs):
+    """
+    Performs operation on every item in batch with the execution backend
+    set in amt_client_params
+    :param operation: BotoThreadedOperation subclass to perform
+    :param batch: items (HITs, assignments or request params) to operate on
+    :param kwargs: client params, must contain backend. An on_response callable, if
+    given, is called with (index, response) as soon as each response arrives
+    :return: generator of (index, response) pairs, in input order
+    """
+    available_backends = {
+        'threads': _stream_threaded,
+        'asyncio': _stream_async,
+    }
+    backend = available_backends.get(kwargs['backend'], None)
+    if not backend:
+        raise NotImplementedError(f"{kwargs['backend']} is not an available backend")
+    return backend(operation, batch, **kwargs)
+
+
+def _stream_threaded(operation, batch, **kwargs):
+    """
+    Workers pull the next item from a shared queue as soon as they are free, so a
+    slow or throttled request only holds up the worker making it. The queue is bounded
+    and refilled from batch by a feeder thread, so batch may be a lazy iterator whose
+    items are only produced as fast as they are sent.
+    """
+    n_workers = kwargs['n_threads']
+    if hasattr(batch, '__len__'):
+        n_workers = max(1, min(n_workers, len(batch)))
+    work_queue = queue.Queue(maxsize=2 * n_workers)
+    res_queue = queue.Queue()
+    feed_errors = []
+
+    def feed():
+        try:
+            for item in enumerate(batch):
+                work_queue.put(item)
+        except Exception as err:
+            feed_errors.append(err)
+        finally:
+            for _ in range(n_workers):
+                work_queue.put(_STOP_WORKER)
+
+    def collect():
+        n_stopped = 0
+        while n_stopped < n_workers:
+            result = res_queue.get()
+            if result is _STOP_WORKER:
+                n_stopped += 1
+            else:
+                yield result
+
+    workers = [operation(work_queue, res_queue, **kwargs) for _ in range(n_workers)]
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    for worker in workers:
+        worker.start()
+    n_items = len(batch) if hasattr(batch, '__len__') else None
+    with tqdm(total=n_items) as progress:
+        for idx, response in _in_input_order(collect(), kwargs.get('on_response', None)):
+            progress.update()
+            yield idx, response
+    feeder.join()
+    for worker in workers:
+        worker.join()
+    if feed_errors:
+        raise feed_errors[0]
+
+
+def _stream_async(operation, batch, **kwargs):
+    """
+    A single operation instance (and client) is shared by every request; the
+    operation's thread is never started.
+    """
+    worker = operation(None, None, **kwargs)
+    return stream_async_requests(worker.handle, batch, kwargs['max_concurrency'],
+                                 kwargs.get('on_response', None))
+
+
+def stream_async_requests(request, batch, max_concurrency, on_response=None):
+    """
+    Performs request(point) for every item in batch from an asyncio event loop,
+    keeping at most max_concurrency requests in flight. boto3 calls block, so
+    each one is run in an executor thread while the loop schedules the next. Items
+    are pulled from batch off the loop, so batch may be a lazy iterator.
+    :param request: blocking callable taking a single item
+    :param batch: items to perform request on
+    :param (int) max_concurrency: maximum number of requests in flight
+    :param on_response: called with (index, response) as soon as each response arrives
+    :return: generator of (index, response) pairs, in input order
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    res_queue = queue.Queue()
+
+    async def perform_all(loop, executor, feed_executor):
+        semaphore = asyncio.Semaphore(max_concurrency)
+        batch_iter = iter(batch)
+        end_of_batch = object()
+
+        async def perform(idx, point):
+            try:
+                response = await loop.run_in_executor(executor, request, point)
+                res_queue.put((idx, response, None))
+            except Exception as err:
+                res_queue.put((idx, None, err))
+            finally:
+                semaphore.release()
+
+        tasks = set()
+        try:
+            for idx in itertools.count():
+                await semaphore.acquire()
+                point = await loop.run_in_executor(feed_executor, next, batch_iter, end_of_batch)
+                if point is end_of_batch:
+                    break
+                task = loop.create_task(perform(idx, point))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            await asyncio.gather(*tasks)
+
+    def run_loop():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor, \
+                    ThreadPoolExecutor(max_workers=1) as feed_executor:
+                loop.run_until_complete(perform_all(loop, executor, feed_executor))
+        except Exception as err:
+            res_queue.put((None, None, err))
+        finally:
+            loop.close()
+            res_queue.put(_STOP_WORKER)
+
+    loop_thread = threading.Thread(target=run_loop, daemon=True)
+    loop_thread.start()
+
+    def raise_failures():
+        """
+        Yields every response that arrived before raising the first failure, so requests
+        already sent still reach on_response
+        """
+        failure = None
+        for idx, response, err in iter(res_queue.get, _STOP_WORKER):
+            if err:
+                failure = failure or err
+            else:
+                yield idx, response
+        if failure:
+            raise failure
+
+    n_items = len(batch) if hasattr(batch, '__len__') else None
+    with tqdm(total=n_items) as progress:
+        for idx, response in _in_input_order(raise_failures(), on_response):
+            progress.update()
+            yield idx, response
+    loop_thread.join()
+
+
+def _in_input_order(results, on_response=None):
+    """
+    Reorders (index, response) pairs, yielding each as soon as every earlier index has been.
+    on_response is called in arrival order, before a response waits on earlier ones.
+    """
+    pending = {}
+    next_idx = 0
+    for idx, response in results:
+        if on_response:
+            on_response(idx, response)
+        pending[idx] = response
+        while next_idx in pending:
+            yield next_idx, pending.pop(next_idx)
+            next_idx += 1
+
+
 @decorator
 @configure
 def amt_serial_action(action, *args, **kwargs):
-    client_config = kwargs['configuration']['amt_client_params']
-    amt_client = MturkClient(**client_config).amt_client()
+    configs = kwargs['configuration']
+    client_config = configs['amt_client_params']
     action_name, request_batch = action(*args, **kwargs)
-    client_action = getattr(amt_client, action_name)
-    resp = [client_action(**req) for req in tqdm(request_batch)]
+    metrics = MetricsCollector(action_name)
+    with _open_dead_letters(action_name, configs) as dead_letters, open_trace(action_name, configs) as trace:
+        amt = MturkClient(dead_letters=dead_letters, metrics=metrics, trace=trace, **client_config)
+        client_action = getattr(amt.amt_client(), action_name)
+        if client_config['backend'] == 'asyncio':
+            responses = stream_async_requests(
+                lambda req: amt.perform(client_action, **req), request_batch, client_config['max_concurrency'])
+            resp = [res for _, res in responses]
+        else:
+            resp = [amt.perform(client_action, **req) for req in tqdm(request_batch)]
+    metrics.finish(len(resp))
     resp = list(filter(None, resp))
     print('\n')
     from .log import logger
     logger.info('performed %s %s actions', len(resp), action_name)
+    _log_request_rate(**client_config)
+    _log_dead_letters(dead_letters)
+    _report_metrics(metrics, configs)
     return resp
 
 
+def _open_dead_letters(action_name, configs):
+    """
+    Opens the file that requests still failing after every retry are written to, so they
+    can be replayed with management.retry_failed_requests
+    :return (JsonLinesWriter): dead letter writer, the file is only created on first failure
+    """
+    from .serialize import JsonLinesWriter
+    from .utils import prepare_output_path
+    dead_letter_fp = prepare_output_path('failed--' + action_name, configs) + '.jsonl'
+    return JsonLinesWriter(dead_letter_fp)
+
+
+def _log_dead_letters(dead_letters):
+    if dead_letters.n_written:
+        from .log import logger
+        logger.warning('%s failed requests written to %s', dead_letters.n_written, dead_letters.file_name)
+
+
+def _log_request_rate(**kwargs):
+    from .log import logger
+    rate_report = get_rate_limiter(**kwargs).report()
+    logger.info('request rate limit settled at %s/s, sustained %s/s with %s throttled requests',
+                rate_report['rate_limit'], rate_report['sustained_rate'], rate_report['n_throttled'])
+
+
+def _report_metrics(metrics, configs):
+    """
+    Logs request latencies and throughput, and writes the metrics next to the action's results
+    :param (MetricsCollector) metrics: the action's metrics
+    :param configs: configuration
+    :return: None
+    """
+    from .log import logger
+    summary = metrics.summary()
+    for operation, stats in summary['operations'].items():
+        logger.info('%s: %s requests, latency p50 %ss p99 %ss, %s retried, %s failed %s',
+                    operation, stats['requests'], stats['latency_s']['p50'], stats['latency_s']['p99'],
+                    stats['retries'], stats['failed'], stats['error_codes'] or '')
+    logger.info('%s items in %ss, %s items/s', summary['items'], summary['elapsed_s'], summary['items_per_second'])
+    serialization_params = configs['serialization_params']
+    if not serialization_params['write_metrics']:
+        return
+    import json
+    from .utils import prepare_output_path
+    metrics_fp = prepare_output_path('metrics--' + metrics.action_name, configs)
+    with open(metrics_fp + '.json', 'w') as file:
+        json.dump(summary, file, indent=2)
+    if serialization_params['prometheus_metrics']:
+        with open(metrics_fp + '.prom', 'w') as file:
+            file.write(metrics.to_prometheus())
+
+
 @decorator
 @configure
 def amt_single_action(action, *args, **kwargs):
-    client_config = kwargs['configuration']['amt_client_params']
+    configs = kwargs['configuration']
+    client_config = configs['amt_client_params']
     amt_client = MturkClient(**client_config).amt_client()
     action_name, client_action_args = action(*args, **kwargs)
     client_action = getattr(amt_client, action_name)
-    if not client_action_args:
-        return client_action()
-    resp = client_action(**client_action_args)
+    with open_trace(action_name, configs) as trace:
+        started = time.monotonic()
+        try:
+            resp = client_action(**client_action_args) if client_action_args else client_action()
+        except Exception as err:
+            if trace:
+                trace_call(trace, action_name, client_action_args or {}, time.monotonic() - started,
+                           outcome=_error_code(err))
+            raise
+        if trace:
+            trace_call(trace, action_name, client_action_args or {}, time.monotonic() - started, resp)
     from .log import logger
-    logger.info('performed %s action', action_name)
+    logger.debug('%s took %.3fs', action_name, time.monotonic() - started)
+    if client_action_args:
+        logger.info('performed %s action', action_name)
+    from .store import upsert_records
+    upsert_records(resp, **kwargs)
     return resp
 
 
+_ENDPOINTS = {
+    True: 'https://mturk-requester.us-east-1.amazonaws.com',
+    False: 'https://mturk-requester-sandbox.us-east-1.amazonaws.com'
+}
+_client_pool = {}
+_client_pool_lock = threading.Lock()
+
+
+def get_client(service_name, profile_name, endpoint_url=None, in_production=False, max_pool_connections=10):
+    """
+    Returns a boto3 client from the process-wide pool, creating the session and client on
+    first use. boto3 clients are thread-safe, so one client is shared by every thread and
+    coroutine; it is only rebuilt when more connections are needed than it was sized for.
+    :param service_name: AWS service, e.g. mturk or s3
+    :param profile_name: AWS credentials profile
+    :param endpoint_url: service endpoint, None for the default
+    :param (bool) in_production: whether the client talks to the production environment
+    :param (int) max_pool_connections: number of connections the client should keep open
+    :return: boto3 client
+    """
+    key = (service_name, profile_name, endpoint_url, in_production)
+    with _client_pool_lock:
+        pooled = _client_pool.get(key, None)
+        if not pooled or pooled[1] < max_pool_connections:
+            session = boto3.Session(profile_name=profile_name)
+            client = session.client(
+                service_name=service_name,
+                endpoint_url=endpoint_url,
+                config=BotoConfig(max_pool_connections=max_pool_connections),
+            )
+            pooled = (client, max_pool_connections)
+            _client_pool[key] = pooled
+        return pooled[0]
+
+
+def _n_connections(**kwargs):
+    """
+    :return (int): connections needed for the configured concurrency
+    """
+    concurrency = kwargs['max_concurrency'] if kwargs['backend'] == 'asyncio' else kwargs['n_threads']
+    return max(10, concurrency)
+
+
 class MturkClient:
     def __init__(self, **kwargs):
-        session = boto3.Session(profile_name=kwargs['profile_name'])
         in_production = kwargs.get('in_production', False)
-        endpoints = {
-            True: 'https://mturk-requester.us-east-1.amazonaws.com',
-            False: 'https://mturk-requester-sandbox.us-east-1.amazonaws.com'
-        }
-        self.client = session.client(
-            service_name='mturk',
-            endpoint_url=endpoints[in_production],
+        self.client = get_client(
+            'mturk',
+            kwargs['profile_name'],
+            endpoint_url=_ENDPOINTS[in_production],
+            in_production=in_production,
+            max_pool_connections=_n_connections(**kwargs),
         )
+        self.rate_limiter = get_rate_limiter(**kwargs)
+        self.max_retries = kwargs['max_retries']
+        self.dead_letters = kwargs.get('dead_letters', None)
+        self.metrics = kwargs.get('metrics', None)
+        self.trace = kwargs.get('trace', None)
 
     def perform(self, action, **kwargs):
+        """
+        Performs a client action once the shared rate limiter allows it. Throttled
+        requests slow the limiter down and are retried with jittered backoff.
+        Requests that still fail are written to the dead letter file, if one was given.
+        :param action: client method
+        :return: AMT client response, None if the request failed
+        """
         allowed_exceptions = (
             ClientError,
             self.client.exceptions.RequestError,
         )
-        try:
-            response = action(**kwargs)
-            return response
-        except allowed_exceptions as err:
-            from .log import logger
-            logger.error('HITId: %s || %s', kwargs.get('HITId', ''), err)
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            started = time.monotonic()
+            try:
+                response = action(**kwargs)
+                self._record(action, kwargs, started, attempt, response)
+                self.rate_limiter.on_success()
+                return response
+            except allowed_exceptions as err:
+                throttled = is_throttling_error(err)
+                retry = throttled and attempt < self.max_retries
+                self._record(action, kwargs, started, attempt, error_code=_error_code(err),
+                             throttled=throttled, retried=retry)
+                if retry:
+                    self.rate_limiter.on_throttle()
+                    time.sleep(backoff_delay(attempt))
+                    continue
+                from .log import logger
+                logger.error('HITId: %s || %s', kwargs.get('HITId', ''), err)
+                if self.dead_letters:
+                    self.dead_letters.write({
+                        'operation': action.__name__,
+                        'request': kwargs,
+                        'error_code': _error_code(err),
+                        'error': str(err),
+                    })
+                return None
+            except Exception as err:
+                self._record(action, kwargs, started, attempt, error_code=_error_code(err))
+                raise
+
+    def _record(self, action, request, started, attempt, response=None, error_code=None,
+                throttled=False, retried=False):
+        latency = time.monotonic() - started
+        if self.metrics:
+            self.metrics.record_request(action.__name__, latency, error_code, throttled, retried)
+        if self.trace:
+            outcome = 'throttled' if throttled else error_code or 'ok'
+            trace_call(self.trace, action.__name__, request, latency, response, outcome, attempt)
 
     def amt_client(self):
         return self.client
 
 
+def _error_code(err):
+    """
+    :return (str): AMT error code of a ClientError, or the exception's type name
+    """
+    return getattr(err, 'response', {}).get('Error', {}).get('Code', '') or type(err).__name__
+
+
 class BotoThreadedOperation(threading.Thread):
-    def __init__(self, batch, target_queue, **kwargs):
+    def __init__(self, work_queue, target_queue, **kwargs):
         self.amt = MturkClient(**kwargs)
-        self._batch = batch
+        self._work_queue = work_queue
         self._queue = target_queue
-        super().__init__()
+        super().__init__(daemon=True)
 
-    @abc.abstractmethod
     def run(self):
-        responses = []
-        self._queue.put(responses)
+        while True:
+            item = self._work_queue.get()
+            if item is _STOP_WORKER:
+                self._queue.put(_STOP_WORKER)
+                break
+            idx, point = item
+            self._queue.put((idx, self.handle(point)))
+
+    def handle(self, point):
+        try:
+            return self.process(point)
+        except Exception as err:
+            from .log import logger
+            logger.exception('%s failed || %s', type(self).__name__, err)
+
+    @abc.abstractmethod
+    def process(self, point):
+        """
+        Performs the operation's request for a single item
+        :param point: HIT, assignment or request params
+        :return: AMT client response
+        """
 
 
 class CreateHits(BotoThreadedOperation):
-    def __init__(self, batch, target_queue, **kwargs):
-        super().__init__(batch, target_queue, **kwargs)
+    def __init__(self, work_queue, target_queue, **kwargs):
+        super().__init__(work_queue, target_queue, **kwargs)
         self.action = getattr(self.amt.client, 'create_hit')
 
-    def run(self):
-        responses = [self.amt.perform(self.action, **point)
-                     for point in tqdm(self._batch)]
-        self._queue.put(responses)
+    def process(self, point):
+        return self.amt.perform(self.action, **point)
+
+
+class CreateHitsWithHitType(BotoThreadedOperation):
+    def __init__(self, work_queue, target_queue, **kwargs):
+        super().__init__(work_queue, target_queue, **kwargs)
+        self.action = getattr(self.amt.client, 'create_hit_with_hit_type')
+
+    def process(self, point):
+        return self.amt.perform(self.action, **point)
 
 
 class GetHITs(BotoThreadedOperation):
-    def __init__(self, batch, target_queue, **kwargs):
-        super().__init__(batch, target_queue, **kwargs)
+    def __init__(self, work_queue, target_queue, **kwargs):
+        super().__init__(work_queue, target_queue, **kwargs)
         self.action = getattr(self.amt.client, 'get_hit')
 
-    def run(self):
-        hits = []
-        for hit in tqdm(self._batch):
-            action_args = {
-                'HITId': hit['HITId'],
-            }
-            hits.append(self.amt.perform(self.action, **action_args))
-        self._queue.put(hits)
+    def process(self, point):
+        action_args = {
+            'HITId': point['HITId'],
+        }
+        return self.amt.perform(self.action, **action_args)
 
 
 class GetAssignments(BotoThreadedOperation):
-    def __init__(self, batch, target_queue, **kwargs):
-        super().__init__(batch, target_queue, **kwargs)
+    def __init__(self, work_queue, target_queue, **kwargs):
+        super().__init__(work_queue, target_queue, **kwargs)
         self.action = getattr(self.amt.client, 'list_assignments_for_hit')
 
-    def run(self):
-        assignments = []
-        for hit in tqdm(self._batch):
-            action_args = {
-                'HITId': hit['HITId'],
-                'AssignmentStatuses': ['Submitted', 'Approved'],
-                'MaxResults': 50
-            }
-            assignments.append(self.amt.perform(self.action, **action_args))
-        self._queue.put(assignments)
+    def process(self, point):
+        action_args = {
+            'HITId': point['HITId'],
+            'AssignmentStatuses': ['Submitted', 'Approved'],
+            'MaxResults': 50
+        }
+        return self.amt.perform(self.action, **action_args)
 
 
 class ApproveAssignments(BotoThreadedOperation):
-    def __init__(self, batch, target_queue, **kwargs):
-        super().__init__(batch, target_queue, **kwargs)
+    def __init__(self, work_queue, target_queue, **kwargs):
+        super().__init__(work_queue, target_queue, **kwargs)
         self.action = getattr(self.amt.client, 'approve_assignment')
 
-    def run(self):
-        responses = []
-        for assignment in tqdm(self._batch):
-            action_args = {
-                'AssignmentId': assignment['AssignmentId'],
-                'RequesterFeedback': 'good',
-                'OverrideRejection': False
-            }
-            responses.append(self.amt.perform(self.action, **action_args))
-        self._queue.put(responses)
+    def process(self, point):
+        action_args = {
+            'AssignmentId': point['AssignmentId'],
+            'RequesterFeedback': 'good',
+            'OverrideRejection': False
+        }
+        return self.amt.perform(self.action, **action_args)
 
 
 class UpdateHITsReviewStatus(BotoThreadedOperation):
-    def __init__(self, batch, target_queue, **kwargs):
-        super().__init__(batch, target_queue, **kwargs)
+    def __init__(self, work_queue, target_queue, **kwargs):
+        super().__init__(work_queue, target_queue, **kwargs)
         self.revert = kwargs['revert']
         self.action = getattr(self.amt.client, 'update_hit_review_status')
 
-    def run(self):
-        responses = [self.amt.perform(
-            self.action, HITId=h['HITId'], Revert=self.revert) for h in tqdm(self._batch)]
-        self._queue.put(responses)
+    def process(self, point):
+        return self.amt.perform(self.action, HITId=point['HITId'], Revert=self.revert)
 
 
 class ExpireHits(BotoThreadedOperation):
-    def __init__(self, batch, target_queue, **kwargs):
+    def __init__(self, work_queue, target_queue, **kwargs):
         import datetime
-        super().__init__(batch, target_queue, **kwargs)
+        super().__init__(work_queue, target_queue, **kwargs)
         self.action = getattr(self.amt.client, 'update_expiration_for_hit')
         self.exp_date = datetime.datetime(2001, 1, 1)
 
-    def run(self):
-        responses = [self.amt.perform(
-            self.action, HITId=h['HITId'], ExpireAt=self.exp_date) for h in tqdm(self._batch)]
-        self._queue.put(responses)
+    def process(self, point):
+        return self.amt.perform(self.action, HITId=point['HITId'], ExpireAt=self.exp_date)
 
 
 class DeleteHits(BotoThreadedOperation):
-    def __init__(self, batch, target_queue, **kwargs):
-        super().__init__(batch, target_queue, **kwargs)
+    def __init__(self, work_queue, target_queue, **kwargs):
+        super().__init__(work_queue, target_queue, **kwargs)
         self.action = getattr(self.amt.client, 'delete_hit')
 
-    def run(self):
-        to_dispose_hits = [h for h in self._batch if h['HITStatus'] != 'Disposed']
-        responses = [self.amt.perform(
-            self.action, HITId=h['HITId']) for h in tqdm(to_dispose_hits)]
-        self._queue.put(responses)
+    def process(self, point):
+        if point['HITStatus'] == 'Disposed':
+            return None
+        return self.amt.perform(self.action, HITId=point['HITId'])
+
+
+class RetryRequests(BotoThreadedOperation):
+    def process(self, point):
+        action = getattr(self.amt.client, point['operation'])
+        return self.amt.perform(action, **point['request'])
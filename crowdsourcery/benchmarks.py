@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks
+
+Measurements of the package's own overheads, run through the invoke tasks so
+regressions show up before they reach the cron jobs.
+
+Attributes:
+     PACKAGE_MODULES (tuple): modules whose import cost is tracked
+     COMPRESSION_SETTINGS (tuple): (codec, level) pairs compared by benchmark_compression
+"""
+import os
+import random
+import shutil
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import time
+
+PACKAGE_MODULES = (
+    'tasks',
+    'crowdsourcery',
+    'crowdsourcery.config',
+    'crowdsourcery.log',
+    'crowdsourcery.serialize',
+    'crowdsourcery.amt_client',
+    'crowdsourcery.html_hit',
+    'crowdsourcery.rendering',
+    'crowdsourcery.creation',
+    'crowdsourcery.management',
+    'crowdsourcery.storage',
+    'crowdsourcery.workers',
+    'crowdsourcery.viz',
+)
+
+COMPRESSION_SETTINGS = (
+    ('gzip', 1),
+    ('gzip', 6),
+    ('gzip', 9),
+    ('bz2', 9),
+    ('lzma', 1),
+    ('lzma', 6),
+    ('zstd', 3),
+    ('zstd', 10),
+)
+
+
+def measure_import_time(module_name):
+    """
+    Imports a module in a fresh interpreter with -X importtime
+    :param (str) module_name: dotted module name
+    :return (tuple): total import time in ms, list of (dependency, ms) for the third-party
+    packages it pulled in, slowest first
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+        stdin=subprocess.DEVNULL, capture_output=True, text=True
+    )
+    if proc.returncode:
+        error = [line for line in proc.stderr.splitlines() if not line.startswith('import time:')]
+        raise RuntimeError(f'importing {module_name} failed:\n' + '\n'.join(error))
+    parts = module_name.split('.')
+    own_modules = {'.'.join(parts[:idx]) for idx in range(1, len(parts) + 1)}
+    total_us = 0
+    dependencies = []
+    nested = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        cumulative_us = int(fields[1])
+        name = fields[2].strip()
+        depth = (len(fields[2]) - len(fields[2].lstrip()) - 1) // 2
+        if depth > 0:
+            if '.' not in name and name != parts[0] and not _is_stdlib(name):
+                nested.append((name, cumulative_us / 1000))
+            continue
+        # imports are listed before the top level import that pulled them in
+        if name in own_modules:
+            total_us += cumulative_us
+            dependencies.extend(nested)
+        nested = []
+    dependencies.sort(key=lambda dep: dep[1], reverse=True)
+    return total_us / 1000, dependencies
+
+
+def _is_stdlib(module_name):
+    """
+    :param (str) module_name: top level module name
+    :return (bool): whether the module is part of the standard library
+    """
+    if hasattr(sys, 'stdlib_module_names'):
+        return module_name in sys.stdlib_module_names
+    import importlib.util
+    spec = importlib.util.find_spec(module_name)
+    if spec is None or spec.origin in (None, 'built-in', 'frozen'):
+        return spec is not None
+    stdlib_dir = sysconfig.get_paths()['stdlib']
+    return spec.origin.startswith(stdlib_dir) and 'site-packages' not in spec.origin
+
+
+def benchmark_imports(modules=PACKAGE_MODULES, n_dependencies=3):
+    """
+    Measures the cold import cost of each module
+    :param (iterable) modules: dotted module names
+    :param (int) n_dependencies: number of heaviest dependencies to report per module
+    :return (list): (module, ms, heaviest dependencies) tuples, slowest first, with ms set
+    to None for modules that fail to import
+    """
+    results = []
+    for module_name in modules:
+        try:
+            total_ms, dependencies = measure_import_time(module_name)
+        except RuntimeError:
+            total_ms, dependencies = None, []
+        results.append((module_name, total_ms, dependencies[:n_dependencies]))
+    return sorted(results, key=lambda res: -1 if res[1] is None else res[1], reverse=True)
+
+
+_SAMPLE_WORDS = ('which', 'label', 'arrow', 'points', 'to', 'the', 'stage', 'of', 'cycle', 'diagram',
+                 '<input type="radio" name="answer">', '<p>', '</p>', 'energy', 'food', 'web')
+
+
+def sample_hits(n_hits, seed=0):
+    """
+    :return (list): HIT records shaped like create_hit and get_hit responses
+    """
+    rng = random.Random(seed)
+    return [{
+        'HIT': {
+            'HITId': f'{rng.getrandbits(120):030X}',
+            'HITTypeId': '3XJ2ZBJXCZ8TQ9KMDY3H1D9RLNA2P6',
+            'HITGroupId': '3R4DSLZ4W7J8KBQD1NX2EWGDNUR7PV',
+            'CreationTime': '2019-03-04 17:21:09-08:00',
+            'Title': 'Answer questions about a diagram',
+            'Description': 'Look at the diagram and answer multiple choice questions about it',
+            'Question': '<HTMLQuestion><![CDATA[<div class="diagram" data-id="{}">{}</div>]]></HTMLQuestion>'.format(
+                idx, ' '.join(rng.choice(_SAMPLE_WORDS) for _ in range(rng.randint(300, 900)))),
+            'Keywords': 'image, diagram, question answering',
+            'HITStatus': rng.choice(['Assignable', 'Unassignable', 'Reviewable']),
+            'MaxAssignments': 3,
+            'Reward': '0.10',
+            'AutoApprovalDelayInSeconds': 172800,
+            'Expiration': '2019-03-05 05:21:09-08:00',
+            'AssignmentDurationInSeconds': 3600,
+            'RequesterAnnotation': f'{{"globalID": "img_{idx}"}}',
+            'QualificationRequirements': [
+                {'QualificationTypeId': '000000000000000000L0', 'Comparator': 'GreaterThanOrEqualTo',
+                 'IntegerValues': [95], 'RequiredToPreview': True},
+            ],
+            'NumberOfAssignmentsPending': rng.randint(0, 3),
+            'NumberOfAssignmentsAvailable': rng.randint(0, 3),
+            'NumberOfAssignmentsCompleted': rng.randint(0, 3),
+        }
+    } for idx in range(n_hits)]
+
+
+def sample_assignments(n_assignments, seed=0):
+    """
+    :return (list): assignment records shaped like list_assignments_for_hit responses
+    """
+    rng = random.Random(seed)
+    answer_template = ('<QuestionFormAnswers><Answer><QuestionIdentifier>taskAnswers</QuestionIdentifier>'
+                       '<FreeText>{}</FreeText></Answer></QuestionFormAnswers>')
+    return [{
+        'AssignmentId': f'{rng.getrandbits(120):030X}',
+        'WorkerId': f'A{rng.randrange(400):013d}',
+        'HITId': f'{rng.getrandbits(120):030X}',
+        'AssignmentStatus': rng.choice(['Submitted', 'Approved', 'Rejected']),
+        'AutoApprovalTime': '2019-03-06 17:21:09-08:00',
+        'AcceptTime': '2019-03-04 17:25:09-08:00',
+        'SubmitTime': '2019-03-04 17:29:41-08:00',
+        'Answer': answer_template.format(
+            [{f'q{q_idx}': rng.choice('abcd') for q_idx in range(rng.randint(5, 20))}]),
+    } for _ in range(n_assignments)]
+
+
+def benchmark_compression(payloads, settings=COMPRESSION_SETTINGS, output_formats=('json', 'pickle')):
+    """
+    Serializes and loads each payload through serialize_result with every codec and level
+    :param (dict) payloads: records to serialize, keyed by name
+    :param settings: (codec, level) pairs, zstd is skipped if zstandard is not installed
+    :param output_formats: serialization formats to compare
+    :return (list): one dict per payload, format and setting with the output size,
+    compression ratio and write and read times, starting with the uncompressed output
+    """
+    import importlib.util
+    from .serialize import (
+        load_input_data,
+        serialize_result
+    )
+    settings = [(None, None)] + [(codec, level) for codec, level in settings
+                                 if codec != 'zstd' or importlib.util.find_spec('zstandard')]
+    results = []
+    out_dir = tempfile.mkdtemp()
+    try:
+        for payload_name, payload in payloads.items():
+            for output_format in output_formats:
+                plain_size = None
+                for codec, level in settings:
+                    started = time.perf_counter()
+                    serialize_result(payload, output_format, os.path.join(out_dir, 'result'),
+                                     compress=bool(codec), codec=codec or 'gzip', compress_level=level)
+                    write_s = time.perf_counter() - started
+                    out_fp = os.path.join(out_dir, os.listdir(out_dir)[0])
+                    size = os.path.getsize(out_fp)
+                    plain_size = plain_size or size
+                    started = time.perf_counter()
+                    load_input_data(out_fp)
+                    read_s = time.perf_counter() - started
+                    os.remove(out_fp)
+                    results.append({
+                        'payload': payload_name,
+                        'format': output_format,
+                        'codec': codec or 'none',
+                        'level': level,
+                        'size_kb': round(size / 1024, 1),
+                        'ratio': round(plain_size / size, 2),
+                        'write_s': round(write_s, 4),
+                        'read_s': round(read_s, 4),
+                    })
+    finally:
+        shutil.rmtree(out_dir)
+    return results
@@ -6,21 +6,32 @@ Attributes:
 
      _DEFAULT_SETTINGS (dict):
 """
+import json
 import operator
+import os
+import threading
 from functools import reduce
 
 import yaml
 from decorator import decorator
+from .utils import freeze
 
 configuration_yml_fp = None
 
-
-
+_config_cache = {}
+_config_cache_lock = threading.Lock()
 
 _DEFAULT_SETTINGS = {
     'amt_client_params': {
         'in_production': False,
+        'backend': 'threads',
         'n_threads': 1,
+        'max_concurrency': 100,
+        'rate_limit': 5,
+        'max_rate_limit': 100,
+        'max_retries': 5,
+        'use_hit_type': True,
+        'trace_requests': False,
         'profile_name': 'mturk_vision',
         's3_profile_name': 'default'
     },
@@ -32,13 +43,28 @@ _DEFAULT_SETTINGS = {
     },
     'interface_params': {
         'template_dir': 'hit_templates',
-        'preview_dir': 'interface_preview'
+        'preview_dir': 'interface_preview',
+        'render_workers': 2,
+        'render_processes': 0,
+        'render_chunksize': 16,
+        'bytecode_cache_dir': None,
+        'preflight_check': True,
+        'question_type': 'html',
+        'external_page_acl': 'public-read',
+        'minify_html': False,
+        'strict_xml': False
     },
     'serialization_params': {
         'serialize': True,
         'output_dir_base': 'amt_output',
         'output_format': 'json',
-        'compress': False
+        'compress': False,
+        'codec': 'gzip',
+        'compress_level': None,
+        'write_metrics': True,
+        'prometheus_metrics': False,
+        'store': True,
+        'store_fp': None
     },
     'qualifications': {
         'min_accept_rate': 95,
@@ -83,12 +109,59 @@ def _set_defaults(raw_settings):
     :param raw_settings:
     :return:
     """
+    for setting_cat in _DEFAULT_SETTINGS:
+        if not raw_settings.get(setting_cat):
+            raw_settings[setting_cat] = {}
     for setting_cat, settings in raw_settings.items():
         for field, default in _DEFAULT_SETTINGS.get(setting_cat, {}).items():
             if field not in settings:
                 settings[field] = default
 
 
+def _validate_settings(settings):
+    """
+    Checks the settings every action relies on
+    :param settings: settings with defaults applied
+    :return: None, raises ValueError describing the first invalid setting
+    """
+    for field in ('batch_id', 'debug_level'):
+        if field not in settings['experiment_params']:
+            raise ValueError(f'experiment_params.{field} must be set in the configuration file')
+    options = {
+        ('amt_client_params', 'backend'): ('threads', 'asyncio'),
+        ('interface_params', 'question_type'): ('html', 'external'),
+        ('serialization_params', 'output_format'): ('json', 'jsonl', 'pickle'),
+        ('serialization_params', 'codec'): ('gzip', 'bz2', 'lzma', 'zstd'),
+    }
+    for key_path, allowed in options.items():
+        value = get_by_path(settings, key_path)
+        if value not in allowed:
+            raise ValueError(f'{".".join(key_path)} is {value}, must be one of {allowed}')
+
+
+def load_configuration(config_fp, override_configs=None):
+    """
+    Loads, completes and validates a configuration file. Configurations are cached per process
+    by file path, modification time and overrides, and frozen so they can be shared.
+    :param config_fp: path to task config yaml file
+    :param override_configs: list of {'keys': key path, 'value': value} settings to override
+    :return (FrozenDict): configuration
+    """
+    override_key = json.dumps(override_configs, sort_keys=True, default=str) if override_configs else ''
+    cache_key = (os.path.abspath(config_fp), os.path.getmtime(config_fp), override_key)
+    with _config_cache_lock:
+        if cache_key not in _config_cache:
+            configs = _load_config_raw(config_fp)
+            _set_defaults(configs)
+            _convert_setting_durations(configs)
+            if override_configs:
+                for setting in override_configs:
+                    set_by_path(configs, setting['keys'], setting['value'])
+            _validate_settings(configs)
+            _config_cache[cache_key] = freeze(configs)
+        return _config_cache[cache_key]
+
+
 def _convert_setting_durations(raw_settings):
     """
 
@@ -125,12 +198,7 @@ def configure(action, record_config=False, *args, **kwargs):
         if not configuration_yml_fp:
             print('no configuration file set\n')
             set_config_file()
-        configs = _load_config_raw(configuration_yml_fp)
-        _set_defaults(configs)
-        _convert_setting_durations(configs)
-        if override_configs:
-            for setting in override_configs:
-                set_by_path(configs, setting['keys'], setting['value'])
+        configs = load_configuration(configuration_yml_fp, override_configs)
         kwargs.update({'configuration': configs})
     if record_config:
         record_configuration(action, configs)
@@ -155,11 +223,14 @@ def set_config_file():
 
 def record_configuration(action, configs):
     import yaml
-    from crowdsourcery.utils import prepare_output_path
+    from crowdsourcery.utils import (
+        prepare_output_path,
+        thaw
+    )
     out_fn = '--'.join(['record', 'config', action.__name__])
     output_fp = ''.join([prepare_output_path(out_fn, configs), '.yml'])
     with open(output_fp, 'w') as stream:
-        yaml.safe_dump(configs, stream)
+        yaml.safe_dump(thaw(configs), stream)
 
 
 def get_by_path(configs, key_path):
@@ -181,6 +252,3 @@ def set_by_path(configs, key_path, value):
     :return:
     """
     get_by_path(configs, key_path[:-1])[key_path[-1]] = value
-
-
-
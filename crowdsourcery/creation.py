@@ -1,51 +1,237 @@
 # -*- coding: utf-8 -*-
 """Creation of HITs
 """
+import hashlib
+import json
 import os
 from crowdsourcery.config import (
     configure,
 )
 from crowdsourcery.utils import (
+    IndexedView,
     confirm_action,
+    freeze,
+    prepare_output_path,
+    reservoir_sample
 )
 from crowdsourcery.cost import summarize_proposed_task
 from crowdsourcery.serialize import (
+    JsonLinesWriter,
+    discard_spooled_data,
+    iter_json_lines,
     load_interface_arg_generator,
     record_input_data,
     record_template,
-    serialize_action_result
+    serialize_action_result,
+    spool_input_data
 )
 from crowdsourcery.amt_client import (
     amt_multi_action,
     amt_single_action
 )
 from crowdsourcery.html_hit import (
+    BaseHitParams,
+    check_template_contract,
     create_html_hit_params,
     create_hit_params,
-    render_hit_html
+    render_external_page,
+    render_hit_html,
+    split_hit_type_params
+)
+from crowdsourcery.rendering import (
+    stream_hit_html,
+    stream_hit_params
 )
 
 
 @configure(record_config=True)
 @serialize_action_result
-@amt_multi_action
-def create_hits(data, **kwargs):
+def create_hits(data, resume=False, **kwargs):
     """
-    Creates a group of HITs from data and supplied generator and pickles resultant _batch
-    :param data: task data
+    Creates a group of HITs from data and supplied generator and pickles resultant _batch.
+    Each created HIT is appended to a journal as soon as AMT returns it. When resuming,
+    data already in the journal is skipped, so a relaunch only creates the remaining HITs.
+    With amt_client_params.use_hit_type, HITs are created through a cached HIT type so each
+    request only carries the per-HIT params. With interface_params.question_type set to
+    external, the template is rendered and hosted once and each HIT only carries its URL.
+    The page is rendered before confirmation, so template errors surface before any upload.
+    With interface_params.preflight_check, every datum's template arguments are checked
+    against the template before confirmation, which runs the argument generator over the
+    data a second time; turn it off for expensive generators once a batch has passed it.
+    Data without random access, e.g. an iterator, is first spooled to a JSON lines file, so
+    it never needs to fit in memory. Input data is only recorded once the launch is confirmed.
+    :param data: task data, a list, a JsonLinesDataset or any iterable
+    :param resume: only create HITs for data not found in the create_hits journal. Otherwise
+    a journal left by an earlier launch is archived, once the launch is confirmed
     :return: hit objects created
     """
-    summarize_proposed_task(data, **kwargs)
-    confirm_action(f'create {len(data)} hits with these settings? y/n\n')
+    journal_fp = _journal_path(**kwargs)
+    created = _load_journal(journal_fp)
+    n_journaled = len(created)
+    if not resume:
+        created = {}
+    is_spooled = not (hasattr(data, '__len__') and hasattr(data, '__getitem__'))
+    if is_spooled:
+        data = spool_input_data(data, **kwargs)
+    try:
+        keys = [_journal_key(idx, datum) for idx, datum in enumerate(data)]
+        to_create = [idx for idx, key in enumerate(keys) if key not in created]
+        to_create_data = data if len(to_create) == len(keys) else IndexedView(data, to_create)
+        if resume:
+            print(f'{len(created)} hits found in {journal_fp}')
+        arg_gen = load_interface_arg_generator(record=True, **kwargs)
+        interface_params = kwargs['configuration']['interface_params']
+        is_external = interface_params['question_type'] == 'external'
+        if interface_params['preflight_check']:
+            check_template_contract(to_create_data, arg_gen, indices=to_create, **kwargs)
+        page_html = render_external_page(**kwargs) if is_external else None
+        summarize_proposed_task(to_create_data, **kwargs)
+        if n_journaled and not resume:
+            print(f'WARNING: {journal_fp} holds {n_journaled} hits created by an earlier launch. '
+                  'It will be archived and all hits created again, launch with resume to only '
+                  'create the remaining hits')
+        confirm_action(f'create {len(to_create_data)} hits with these settings? y/n\n')
+    except BaseException:
+        if is_spooled:
+            discard_spooled_data(data)
+        raise
+    if not resume:
+        _archive_journal(journal_fp, **kwargs)
     record_input_data(data, **kwargs)
     record_template(**kwargs)
-    # from .log import logger
-    # logger.info('recording HIT configuration at %s', output_fp)
-    arg_gen = load_interface_arg_generator(record=True, **kwargs)
-    hit_batch = [create_html_hit_params(**arg_gen(datum, **kwargs), **kwargs) for datum in data]
+    base_hit_params = create_hit_params(**kwargs)
+    if kwargs['configuration']['amt_client_params']['use_hit_type']:
+        base_hit_params = _with_hit_type(base_hit_params, **kwargs)
+    external_url = publish_external_page(page_html, **kwargs) if is_external else None
+    with JsonLinesWriter(journal_fp, fsync=True) as journal:
+
+        def journal_response(idx, response):
+            if response:
+                journal.write({'key': keys[to_create[idx]], 'response': response})
+
+        created_hits = _launch_hits(to_create_data, arg_gen, base_hit_params, external_url,
+                                    on_response=journal_response, configuration=kwargs['configuration'])
+    if not resume:
+        return created_hits
+    created = _load_journal(journal_fp)
+    return [created[key] for key in keys if key in created]
+
+
+@amt_multi_action
+def _launch_hits(data, arg_gen, base_hit_params, external_url, **kwargs):
+    hit_batch = stream_hit_params(data, arg_gen, base_hit_params, external_url,
+                                  configuration=kwargs['configuration'])
+    if 'HITTypeId' in base_hit_params.params:
+        return 'CreateHitsWithHitType', hit_batch
     return 'CreateHits', hit_batch
 
 
+def _with_hit_type(base_hit_params, **kwargs):
+    """
+    Moves the HIT type level params of a batch into a registered HIT type
+    :param (BaseHitParams) base_hit_params: batch params
+    :return (BaseHitParams): per-HIT batch params carrying the HITTypeId
+    """
+    type_params, hit_params = split_hit_type_params(base_hit_params.params)
+    hit_params['HITTypeId'] = get_hit_type_id(type_params, **kwargs)
+    return BaseHitParams(freeze(hit_params), base_hit_params.frame_height)
+
+
+_hit_type_ids = {}
+
+
+def get_hit_type_id(type_params, **kwargs):
+    """
+    Returns the HITTypeId for a set of HIT type params, registering the HIT type only if
+    it is not already cached. Ids are cached by a hash of the params, per profile and
+    environment, in memory and in <output_dir_base>/hit_type_ids.json.
+    :param type_params: HIT type level params
+    :return (str): HITTypeId
+    """
+    configs = kwargs['configuration']
+    client_params = configs['amt_client_params']
+    environment = 'production' if client_params['in_production'] else 'sandbox'
+    params_json = json.dumps(type_params, sort_keys=True, default=str)
+    params_hash = hashlib.sha256(params_json.encode('utf8')).hexdigest()
+    cache_key = '--'.join([client_params['profile_name'], environment, params_hash])
+    cache_fp = os.path.join(configs['serialization_params']['output_dir_base'], 'hit_type_ids.json')
+    if cache_key not in _hit_type_ids and os.path.exists(cache_fp):
+        with open(cache_fp) as file:
+            _hit_type_ids.update(json.load(file))
+    if cache_key not in _hit_type_ids:
+        _hit_type_ids[cache_key] = create_hit_type(configuration=configs)['HITTypeId']
+        os.makedirs(os.path.dirname(cache_fp) or '.', exist_ok=True)
+        with open(cache_fp, 'w') as file:
+            json.dump(_hit_type_ids, file, indent=4)
+    from .log import logger
+    logger.info('using HIT type %s', _hit_type_ids[cache_key])
+    return _hit_type_ids[cache_key]
+
+
+def publish_external_page(page_html=None, **kwargs):
+    """
+    Uploads the static page of ExternalQuestion HITs, readable by workers with the
+    interface_params.external_page_acl canned ACL. AMT appends the assignment to the page
+    URL, which would invalidate a presigned URL, so the object itself must be readable.
+    :param page_html: page from render_external_page, rendered if not given
+    :return (str): URL of the hosted page
+    """
+    from .storage import upload_object
+    if page_html is None:
+        page_html = render_external_page(**kwargs)
+    page_fp = prepare_output_path('record--external_page', kwargs['configuration']) + '.html'
+    with open(page_fp, 'w') as file:
+        file.write(page_html)
+    extra_args = {'ContentType': 'text/html'}
+    page_acl = kwargs['configuration']['interface_params']['external_page_acl']
+    if page_acl:
+        extra_args['ACL'] = page_acl
+    page_url = upload_object(page_fp, extra_args=extra_args, **kwargs)
+    from .log import logger
+    logger.info('external question page hosted at %s', page_url)
+    return page_url
+
+
+def _journal_key(idx, datum):
+    """
+    :return: the datum's globalID if it has one, its index in the input data otherwise
+    """
+    if isinstance(datum, dict) and 'globalID' in datum:
+        return datum['globalID']
+    return idx
+
+
+def _journal_path(**kwargs):
+    journal_fp = prepare_output_path('journal--create_hits', kwargs['configuration'], include_timestamp=False)
+    return journal_fp + '.jsonl'
+
+
+def _load_journal(journal_fp):
+    """
+    :return (dict): created HITs keyed on their journal key
+    """
+    if not os.path.exists(journal_fp):
+        return {}
+    return {record['key']: record['response'] for record in iter_json_lines(journal_fp)}
+
+
+def _archive_journal(journal_fp, **kwargs):
+    """
+    Moves a journal left by an earlier launch aside so a fresh launch does not resume from it.
+    Archives are never overwritten, even when several are made within a minute.
+    """
+    if os.path.exists(journal_fp):
+        archive_base = prepare_output_path('journal--create_hits', kwargs['configuration'])
+        archive_fp = archive_base + '.jsonl'
+        n_archived = 1
+        while os.path.exists(archive_fp):
+            archive_fp = f'{archive_base}--{n_archived}.jsonl'
+            n_archived += 1
+        os.replace(journal_fp, archive_fp)
+        from .log import logger
+        logger.info('archived previous create_hits journal at %s', archive_fp)
+
+
 @configure(record_config=True)
 @serialize_action_result
 @amt_single_action
@@ -65,17 +251,8 @@ def create_single_hit(datum, **kwargs):
 @serialize_action_result
 @amt_single_action
 def create_hit_type(**kwargs):
-    generic_type_params = [
-        'AutoApprovalDelayInSeconds',
-        'AssignmentDurationInSeconds',
-        'Reward',
-        'Title',
-        'Keywords',
-        'Description',
-        'QualificationRequirements'
-    ]
     hit_params, _ = create_hit_params(**kwargs)
-    hit_type_params = {param: val for param, val in hit_params.items() if param in generic_type_params}
+    hit_type_params, _ = split_hit_type_params(hit_params)
     return 'create_hit_type', hit_type_params
 
 
@@ -98,3 +275,67 @@ def preview_interface(datum, **kwargs):
     with open(preview_out_file, 'w') as file:
         file.write(hit_html)
     return preview_out_file
+
+
+@configure
+def preview_batch(data, n_samples=None, seed=None, **kwargs):
+    """
+    Renders a sample of (or all) data in parallel into interface_params.preview_dir/<batch_id>,
+    with an index page linking every preview. The template argument function and template
+    are loaded once. Each preview is keyed in a manifest on a hash of its inputs: the
+    datum, the configuration and the template and argument module modification times, so
+    previews whose inputs are unchanged since the last run are not rendered again.
+    Previews of data no longer sampled are removed. Samples are drawn in a single pass over data.
+    :param data: task data, any iterable
+    :param n_samples: number of data to sample, all data if None
+    :param seed: random seed for sampling
+    :return: path of the index page
+    """
+    import html
+    task_configs = kwargs['configuration']
+    interface_params = task_configs['interface_params']
+    preview_dir = os.path.join(interface_params['preview_dir'], task_configs['experiment_params']['batch_id'])
+    os.makedirs(preview_dir, exist_ok=True)
+    samples = reservoir_sample(data, n_samples, seed) if n_samples else enumerate(data)
+    manifest_fp = os.path.join(preview_dir, 'manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_fp):
+        with open(manifest_fp) as file:
+            manifest = json.load(file)
+    arg_gen = load_interface_arg_generator(**kwargs)
+    template_fp = os.path.join(interface_params['template_dir'], interface_params['template_file'])
+    render_inputs = json.dumps([os.path.getmtime(template_fp),
+                                os.path.getmtime(interface_params['template_arg_module']),
+                                task_configs], sort_keys=True, default=str)
+    previews = {}
+    index_links = []
+    stale_previews = []
+
+    def stale_data():
+        for idx, datum in samples:
+            preview_filename = f'{idx}.html'
+            datum_json = json.dumps(datum, sort_keys=True, default=str)
+            input_hash = hashlib.sha256((render_inputs + datum_json).encode('utf8')).hexdigest()
+            previews[preview_filename] = input_hash
+            label = html.escape(str(_journal_key(idx, datum)))
+            index_links.append(f'<li><a href="{preview_filename}">{label}</a></li>')
+            if manifest.get(preview_filename) != input_hash or \
+                    not os.path.exists(os.path.join(preview_dir, preview_filename)):
+                stale_previews.append(preview_filename)
+                yield datum
+
+    for sample_idx, hit_html in enumerate(stream_hit_html(stale_data(), arg_gen, **kwargs)):
+        with open(os.path.join(preview_dir, stale_previews[sample_idx]), 'w') as file:
+            file.write(hit_html)
+    for preview_filename in set(manifest).difference(previews):
+        preview_out_file = os.path.join(preview_dir, preview_filename)
+        if os.path.exists(preview_out_file):
+            os.remove(preview_out_file)
+    with open(manifest_fp, 'w') as file:
+        json.dump(previews, file, indent=4)
+    index_fp = os.path.join(preview_dir, 'index.html')
+    with open(index_fp, 'w') as file:
+        file.write('<!DOCTYPE html>\n<html><body><ol>\n{}\n</ol></body></html>\n'.format('\n'.join(index_links)))
+    from .log import logger
+    logger.info('%s previews, %s rendered, index at %s', len(index_links), len(stale_previews), index_fp)
+    return index_fp
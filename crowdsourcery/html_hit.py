@@ -4,38 +4,164 @@
 Attributes:
      _MTURK_DATA_SCHEMA_BASE (str):
      _MTURK_DATA_SCHEMA (dict):
+     MAX_QUESTION_LENGTH (int): maximum length of a HIT's Question accepted by AMT
 """
-import copy
+import collections
+import functools
+import json
+import os
+import re
+import urllib.parse
+from xml.sax.saxutils import escape
 import jinja2
 import xmltodict
-from .utils import recall_template_args
+from .utils import (
+    freeze,
+    recall_template_args
+)
 from .qualifications import build_qualifications
 
+BaseHitParams = collections.namedtuple('BaseHitParams', ['params', 'frame_height'])
+HIT_TYPE_PARAMS = (
+    'AutoApprovalDelayInSeconds',
+    'AssignmentDurationInSeconds',
+    'Reward',
+    'Title',
+    'Keywords',
+    'Description',
+    'QualificationRequirements'
+)
+
 
 _MTURK_DATA_SCHEMA_BASE = 'http://mechanicalturk.amazonaws.com/AWSMechanicalTurkDataSchemas/'
 _MTURK_DATA_SCHEMA = {
     'html': ''.join([_MTURK_DATA_SCHEMA_BASE, '2011-11-11/HTMLQuestion.xsd']),
     'external': ''.join([_MTURK_DATA_SCHEMA_BASE, '2006-07-14/ExternalQuestion.xsd'])
 }
+MAX_QUESTION_LENGTH = 131072
+_HTML_QUESTION_XML = """\
+        <HTMLQuestion xmlns="{schema}">
+            <HTMLContent><![CDATA[
+                <!DOCTYPE html>
+                    {question_html}
+                ]]>
+            </HTMLContent>
+            <FrameHeight>{frame_height}</FrameHeight>
+        </HTMLQuestion>"""
+_INVALID_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_PAGE_START_TAG = re.compile(r'<(head|body)(\s[^>]*)?>', re.IGNORECASE)
+_EXTERNAL_ARGS_SCRIPT = """\
+<script>
+(function () {
+    var amtParams = ['assignmentId', 'hitId', 'workerId', 'turkSubmitTo'];
+    var templateArgs = {};
+    new URLSearchParams(window.location.search).forEach(function (value, name) {
+        if (amtParams.indexOf(name) < 0) {
+            templateArgs[name] = JSON.parse(value);
+        }
+    });
+    window.templateArgs = templateArgs;
+    document.addEventListener('DOMContentLoaded', function () {
+        document.querySelectorAll('[data-template-arg]').forEach(function (element) {
+            var value = element.getAttribute('data-template-arg').split('.').reduce(function (obj, key) {
+                return obj === undefined || obj === null ? undefined : obj[key];
+            }, templateArgs);
+            if (value !== undefined) {
+                element.textContent = typeof value === 'string' ? value : JSON.stringify(value);
+            }
+        });
+    });
+})();
+</script>
+"""
 
 
 def create_hit_params(**kwargs):
-    hit_params = copy.deepcopy(kwargs['configuration']['hit_params'])
+    """
+    Builds the HIT params shared by every HIT in a batch, including its qualifications.
+    The params are frozen, so they can be built once per batch and shared between threads.
+    :return (BaseHitParams): frozen HIT params and the frame height
+    """
+    hit_params = dict(kwargs['configuration']['hit_params'])
     frame_height = hit_params.pop('frame_height', '')
     hit_params['QualificationRequirements'] = build_qualifications(**kwargs['configuration'])
-    return hit_params, frame_height
+    return BaseHitParams(freeze(hit_params), frame_height)
+
+
+def split_hit_type_params(hit_params):
+    """
+    :param hit_params: HIT params
+    :return (tuple): HIT type level params, remaining per-HIT params
+    """
+    type_params = {param: val for param, val in hit_params.items() if param in HIT_TYPE_PARAMS}
+    per_hit_params = {param: val for param, val in hit_params.items() if param not in HIT_TYPE_PARAMS}
+    return type_params, per_hit_params
 
 
-def create_html_hit_params(**kwargs):
+def create_html_hit_params(base_hit_params=None, **kwargs):
     """
-    :return
+    :param (BaseHitParams) base_hit_params: batch params from create_hit_params, built if not given
+    :return: HIT params with the rendered Question
     """
-    hit_params, frame_height = create_hit_params(**kwargs)
+    if not base_hit_params:
+        base_hit_params = create_hit_params(**kwargs)
+    interface_params = kwargs['configuration']['interface_params']
     question_html = render_hit_html(**kwargs)
-    hit_params['Question'] = _create_question_xml(question_html, frame_height)
+    hit_params = dict(base_hit_params.params)
+    hit_params['Question'] = _create_question_xml(
+        question_html, base_hit_params.frame_height,
+        minify=interface_params['minify_html'], strict=interface_params['strict_xml'])
+    return hit_params
+
+
+def create_external_hit_params(base_hit_params, external_url, template_args):
+    """
+    Builds HIT params for an ExternalQuestion pointing at a hosted template page. The
+    datum's template arguments are passed JSON encoded in the URL query string, where the
+    page's loader script reads them.
+    :param (BaseHitParams) base_hit_params: batch params from create_hit_params
+    :param (str) external_url: URL of the hosted template page
+    :param (dict) template_args: the datum's template arguments
+    :return: HIT params with the ExternalQuestion
+    """
+    query_args = {arg: json.dumps(val, default=str) for arg, val in template_args.items()}
+    question_url = '?'.join([external_url, urllib.parse.urlencode(query_args)]) if query_args else external_url
+    hit_params = dict(base_hit_params.params)
+    hit_params['Question'] = _create_external_question_xml(question_url, base_hit_params.frame_height)
     return hit_params
 
 
+def check_template_contract(data, arg_gen, indices=None, **kwargs):
+    """
+    Checks, before any render or API call, that the template argument generator supplies
+    every variable the template uses for every datum. Data are grouped by the argument
+    keys generated for them, so the template is compared once per distinct key set. The
+    generator runs over every datum on the render threads or processes, so the check costs
+    one extra pass of the generator over the data, on top of the one made when rendering.
+    :param data: task data
+    :param arg_gen: template argument generator
+    :param indices: index of each datum in the input data, e.g. when data is what is left
+    to create after resuming. Defaults to the position in data
+    :return: None, raises ValueError listing every offending datum index
+    """
+    from .log import logger
+    from .rendering import stream_arg_keys
+    template_args = recall_template_args(**kwargs)
+    indices_by_keys = collections.defaultdict(list)
+    arg_keys = stream_arg_keys(data, arg_gen, configuration=kwargs['configuration'])
+    for idx, datum_arg_keys in zip(indices if indices is not None else range(len(data)), arg_keys):
+        indices_by_keys[datum_arg_keys].append(idx)
+    n_offending = 0
+    for arg_keys, offending in indices_by_keys.items():
+        missing_args = template_args.difference(arg_keys, kwargs)
+        if missing_args:
+            n_offending += len(offending)
+            logger.error('%s referenced in template but not supplied for data at indices %s',
+                         sorted(missing_args), offending)
+    if n_offending:
+        raise ValueError(f'template arguments missing for {n_offending} data')
+
+
 def render_hit_html(**kwargs):
     """
     Creates Jinja environment and renders template using fields present in
@@ -48,33 +174,182 @@ def render_hit_html(**kwargs):
     missing_args = recall_template_args(**kwargs).difference(set(kwargs.keys()))
     if missing_args:
         print(f'{missing_args} are referenced in template but not supplied by template generator')
-    env = jinja2.Environment(loader=jinja2.FileSystemLoader(
-        interface_params['template_dir']))
-    template = env.get_template(interface_params['template_file'])
+    template = load_template(**kwargs)
     return template.render(**kwargs)
 
 
-def _create_question_xml(question_html, frame_height, turk_schema='html'):
+def render_external_page(**kwargs):
     """
-    Embeds question HTML in AMT in HTMLQuestion XML schema
-    :param question_html: HTML
+    Renders the template once, without any datum, as the static page of ExternalQuestion
+    HITs. Template variables the datum supplies render empty, as null through tojson and
+    as 0 in arithmetic, and a loader script is added that exposes the datum's arguments
+    from the URL query string as window.templateArgs and fills the text of elements with a
+    data-template-arg attribute, e.g. <span data-template-arg="image.url"></span>
+    :return: HTML of the hosted page, raises ValueError if the template still needs a datum
+    """
+    try:
+        page_html = load_template(lenient=True, **kwargs).render(**kwargs)
+    except (jinja2.UndefinedError, TypeError, ValueError) as err:
+        template_file = kwargs['configuration']['interface_params']['template_file']
+        raise ValueError(f'{template_file} cannot be rendered without a datum for an external question: {err}')
+    start_tag = _PAGE_START_TAG.search(page_html)
+    if not start_tag:
+        return _EXTERNAL_ARGS_SCRIPT + page_html
+    return page_html[:start_tag.end()] + '\n' + _EXTERNAL_ARGS_SCRIPT + page_html[start_tag.end():]
+
+
+class _LenientUndefined(jinja2.Undefined):
+    """
+    Undefined that renders empty however it is used, including attribute and item access,
+    arithmetic and calls, for variables only known once a hosted page reads its URL. It
+    converts to 0 and compares as neither smaller nor larger than anything.
+    """
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        if name[:2] == '__':
+            raise AttributeError(name)
+        return self
+
+    def __html__(self):
+        return ''
+
+    def __int__(self):
+        return 0
+
+    def __float__(self):
+        return 0.0
+
+    def __complex__(self):
+        return 0j
+
+    def _chain(self, *args, **kwargs):
+        return self
+
+    def _compare(self, other):
+        return False
+
+    __getitem__ = __call__ = __pos__ = __neg__ = _chain
+    __add__ = __radd__ = __sub__ = __rsub__ = __mul__ = __rmul__ = _chain
+    __truediv__ = __rtruediv__ = __floordiv__ = __rfloordiv__ = _chain
+    __mod__ = __rmod__ = __pow__ = __rpow__ = _chain
+    __lt__ = __le__ = __gt__ = __ge__ = _compare
+
+
+def _undefined_to_json(obj):
+    if isinstance(obj, jinja2.Undefined):
+        return None
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def _dumps_lenient_json(obj, **kwargs):
+    return json.dumps(obj, default=_undefined_to_json, **kwargs)
+
+
+def load_template(lenient=False, **kwargs):
+    """
+    Loads the template set in interface_params. The environment and compiled template are
+    cached per process and only rebuilt when the template file is modified.
+    :param (bool) lenient: render undefined variables, and their attributes, as empty
+    :return: compiled Jinja template
+    """
+    interface_params = kwargs['configuration']['interface_params']
+    template_dir = interface_params['template_dir']
+    template_file = interface_params['template_file']
+    template_mtime = os.path.getmtime(os.path.join(template_dir, template_file))
+    return _compile_template(template_dir, template_file, template_mtime,
+                             interface_params['bytecode_cache_dir'], lenient)
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_template(template_dir, template_file, template_mtime, bytecode_cache_dir=None, lenient=False):
+    """
+    :param template_mtime: only used as part of the cache key
+    :param bytecode_cache_dir: directory to keep compiled templates in across runs
+    :param (bool) lenient: use _LenientUndefined for undefined variables
+    """
+    bytecode_cache = None
+    if bytecode_cache_dir:
+        os.makedirs(bytecode_cache_dir, exist_ok=True)
+        bytecode_cache = jinja2.FileSystemBytecodeCache(bytecode_cache_dir)
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_dir),
+                             bytecode_cache=bytecode_cache, auto_reload=False,
+                             undefined=_LenientUndefined if lenient else jinja2.Undefined)
+    if lenient:
+        env.policies['json.dumps_function'] = _dumps_lenient_json
+    return env.get_template(template_file)
+
+
+def _create_external_question_xml(question_url, frame_height, turk_schema='external'):
+    """
+    :param (str) question_url: URL of the page workers see
     :param (int) frame_height: height of mturk Iframe
     :param (str) turk_schema: schema type- must be defined in _MTURK_DATA_SCHEMA
     :return: xml schema
     """
-    hit_xml = f"""\
-        <HTMLQuestion xmlns="{_MTURK_DATA_SCHEMA[turk_schema]}">
-            <HTMLContent><![CDATA[
-                <!DOCTYPE html>
-                    {question_html}
-                ]]>
-            </HTMLContent>
+    return f"""\
+        <ExternalQuestion xmlns="{_MTURK_DATA_SCHEMA[turk_schema]}">
+            <ExternalURL>{escape(question_url)}</ExternalURL>
             <FrameHeight>{frame_height}</FrameHeight>
-        </HTMLQuestion>"""
+        </ExternalQuestion>"""
+
+
+def _create_question_xml(question_html, frame_height, turk_schema='html', minify=False, strict=False):
+    """
+    Embeds question HTML in AMT in HTMLQuestion XML schema. The envelope is validated once
+    per schema and frame height. The HTML itself only has its CDATA terminators escaped and
+    is checked for characters XML does not allow, instead of reparsing the whole question.
+    :param question_html: HTML
+    :param (int) frame_height: height of mturk Iframe
+    :param (str) turk_schema: schema type- must be defined in _MTURK_DATA_SCHEMA
+    :param (bool) minify: strip indentation and blank lines from the HTML
+    :param (bool) strict: parse the complete question XML, for debugging
+    :return: xml schema
+    """
+    _validate_question_envelope(turk_schema, frame_height)
+    invalid_char = _INVALID_XML_CHARS.search(question_html)
+    if invalid_char:
+        from .log import logger
+        logger.error('question HTML contains %r at position %s', invalid_char.group(), invalid_char.start())
+        raise ValueError('question HTML contains characters not allowed in XML')
+    if minify:
+        question_html = minify_html(question_html)
+    question_html = question_html.replace(']]>', ']]]]><![CDATA[>')
+    hit_xml = _HTML_QUESTION_XML.format(schema=_MTURK_DATA_SCHEMA[turk_schema],
+                                        question_html=question_html, frame_height=frame_height)
+    if len(hit_xml) > MAX_QUESTION_LENGTH:
+        from .log import logger
+        logger.error('question is %s characters long, AMT accepts at most %s', len(hit_xml), MAX_QUESTION_LENGTH)
+        raise ValueError('question exceeds the AMT size limit')
+    if strict:
+        try:
+            xmltodict.parse(hit_xml)
+        except xmltodict.expat.ExpatError as err:
+            from .log import logger
+            logger.error(err)
+            raise
+    return hit_xml
+
+
+@functools.lru_cache(maxsize=None)
+def _validate_question_envelope(turk_schema, frame_height):
+    envelope_xml = _HTML_QUESTION_XML.format(schema=_MTURK_DATA_SCHEMA[turk_schema],
+                                             question_html='', frame_height=frame_height)
     try:
-        xmltodict.parse(hit_xml)
-        return hit_xml
+        xmltodict.parse(envelope_xml)
     except xmltodict.expat.ExpatError as err:
         from .log import logger
         logger.error(err)
         raise
+
+
+def minify_html(html):
+    """
+    Strips indentation and blank lines. HTML containing pre or textarea elements, where
+    whitespace is significant, is returned unchanged.
+    :param html: HTML
+    :return: minified HTML
+    """
+    if '<pre' in html or '<textarea' in html:
+        return html
+    return '\n'.join(line.strip() for line in html.splitlines() if line.strip())
@@ -5,10 +5,20 @@ This module creates a logger object that is shared amongst other modules in the
 package. The logging level is specified in the task_config.yml file, and
 the log output path is generated dynamically based on the project name and batch id
 
+Logging is initialized on first use of the logger rather than at import time, since
+initialization loads the task configuration and creates the output directory.
+Records are handed to a queue and written by a listener thread, so worker threads
+never block on console or file I/O.
+
 Attributes:
      LOG_LEVELS (dict): map from debug names to level integers in the logging package
 """
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
+import threading
 # from .utils import prepare_output_path
 import crowdsourcery.utils as utils
 # from .config import configure
@@ -20,6 +30,10 @@ LOG_LEVELS = {
     'warning': logging.WARNING
 }
 
+_listener = None
+_initialized = False
+_init_lock = threading.RLock()
+
 
 @config.configure
 def init_logging(log_format='default', **kwargs):
@@ -29,27 +43,87 @@ def init_logging(log_format='default', **kwargs):
     : **kwargs: Arbitrary keyword arguments, must contain configuration
     :return: None
     """
+    global _listener
     task_config = kwargs['configuration']
     log_level = task_config['experiment_params']['debug_level']
     base_logging_level = LOG_LEVELS.get(log_level, None)
     if not base_logging_level:
         raise TypeError(f'{log_level} is an incorrect logging type!')
-    if not logger.handlers:
+    if not _logger.handlers:
         if log_format == 'default':
             log_format = '%(asctime)s: %(levelname)s: %(message)s \t[%(filename)s: %(lineno)d]'
         date_format = '%m/%d %I:%M:%S'
         formatter = logging.Formatter(fmt=log_format, datefmt=date_format)
         log_out_path = utils.prepare_output_path('log.txt', task_config, include_timestamp=False)
         chan = logging.StreamHandler()
-        file_handler = logging.FileHandler(log_out_path)
-        logger.setLevel(base_logging_level)
+        file_handler = logging.FileHandler(log_out_path, delay=True)
+        _logger.setLevel(base_logging_level)
         file_handler.setLevel(base_logging_level)
         chan.setLevel(base_logging_level)
         chan.setFormatter(formatter)
         file_handler.setFormatter(formatter)
-        logger.addHandler(chan)
-        logger.addHandler(file_handler)
+        log_queue = queue.SimpleQueue()
+        _logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, chan, file_handler, respect_handler_level=True)
+        _listener.start()
+
+
+def stop_logging():
+    """
+    Flushes queued records and stops the listener thread, registered to run at exit
+    :return: None
+    """
+    global _listener
+    if _listener:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _reset_after_fork():
+    """
+    A forked child inherits the queue handler but not the listener thread, so its
+    logging is set up again on first use
+    """
+    global _listener, _initialized, _init_lock
+    _listener = None
+    _initialized = False
+    _init_lock = threading.RLock()
+    for handler in list(_logger.handlers):
+        _logger.removeHandler(handler)
+
+
+def get_logger():
+    """
+    :return (logging.Logger): the package logger, initializing logging on first call
+    """
+    global _initialized
+    if not _initialized:
+        with _init_lock:
+            if not _initialized:
+                _initialized = True
+                try:
+                    init_logging()
+                except BaseException:
+                    _initialized = False
+                    raise
+    return _logger
+
+
+class _LazyLogger:
+    """
+    Stands in for the package logger until it is first used
+    """
+    def __getattr__(self, name):
+        return getattr(get_logger(), name)
+
+    def __repr__(self):
+        return f'<lazy {_logger!r}>'
 
 
-logger = logging.getLogger(__name__)
-init_logging()
+_logger = logging.getLogger(__name__)
+logger = _LazyLogger()
+atexit.register(stop_logging)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -4,6 +4,7 @@
 """
 from collections import defaultdict
 import json
+import os
 import xmltodict
 from .amt_client import amt_multi_action
 from .config import configure
@@ -11,7 +12,10 @@ from .utils import (
     confirm_action,
     surface_hit_ids
 )
-from .serialize import serialize_action_result
+from .serialize import (
+    iter_json_lines,
+    serialize_action_result
+)
 
 
 @amt_multi_action
@@ -41,7 +45,10 @@ def get_and_extract_results(hits, **kwargs):
     """
     assignments = get_assignments(hits)
     answers = _get_answers(assignments)
-    return _extract_responses(answers)
+    results = _extract_responses(answers)
+    from .store import upsert_results
+    upsert_results(results, **kwargs)
+    return results
 
 
 @amt_multi_action
@@ -113,6 +120,8 @@ def get_all_hits(**kwargs):
     for resp in response_iterator:
         print('Getting next 100 hits')
         response.extend(resp['HITs'])
+    from .store import upsert_records
+    upsert_records(response, in_batch=False, **kwargs)
     return response
 
 
@@ -182,3 +191,39 @@ def get_hit_statuses(hits):
 @surface_hit_ids
 def get_updated_hits(hits, **kwargs):
     return 'GetHITs', hits
+
+
+_JOURNALED_OPERATIONS = ('create_hit', 'create_hit_with_hit_type')
+
+
+@serialize_action_result
+def retry_failed_requests(failed_fp, **kwargs):
+    """
+    Replays the requests recorded in a dead letter file, e.g. failed--ApproveAssignments.
+    The file is renamed from failed-- to replayed-- before its requests are sent, so it is
+    never replayed twice; requests that fail again are written to a new dead letter file.
+    Failed HIT creations are not replayed, since the HITs would be missing from the
+    create_hits journal; relaunch with create_hits(resume=True) instead.
+    :param failed_fp: path of the dead letter file
+    :return: AMT client responses
+    """
+    failed_dir, failed_fn = os.path.split(failed_fp)
+    replayed_fp = os.path.join(failed_dir, failed_fn.replace('failed--', 'replayed--', 1))
+    if not os.path.exists(failed_fp) and os.path.exists(replayed_fp):
+        raise ValueError(f'{failed_fp} was already replayed, see {replayed_fp}')
+    requests = list(iter_json_lines(failed_fp))
+    journaled = sorted({req['operation'] for req in requests if req['operation'] in _JOURNALED_OPERATIONS})
+    if journaled:
+        raise ValueError(f'{failed_fp} holds failed {", ".join(journaled)} requests, relaunch with '
+                         'create_hits(resume=True) to create the missing HITs')
+    if replayed_fp == failed_fp or os.path.exists(replayed_fp):
+        replayed_fp = failed_fp + '.replayed'
+    os.replace(failed_fp, replayed_fp)
+    from .log import logger
+    logger.info('replaying %s requests, moved %s to %s', len(requests), failed_fp, replayed_fp)
+    return _replay_requests(requests, **kwargs)
+
+
+@amt_multi_action
+def _replay_requests(requests, **kwargs):
+    return 'RetryRequests', requests
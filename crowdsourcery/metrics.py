@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Request Metrics
+
+Latency histograms and counters for the requests an action sends to AMT, kept per client
+operation (create_hit, get_assignment, ...). A collector is created for every decorated
+AMT action and handed to its clients alongside the dead letter writer; its summary is
+logged and written next to the action's results, optionally in Prometheus text format.
+
+Attributes:
+     LATENCY_BUCKETS (tuple): upper bounds, in seconds, of the latency histogram buckets
+"""
+import collections
+import math
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.75,
+                   1.0, 1.5, 2.5, 5.0, 10.0, 30.0, math.inf)
+
+
+class OperationStats:
+    """
+    Counters and a latency histogram for a single client operation. Every attempt is
+    a request, so a throttled request retried twice counts three requests and two retries.
+    """
+    def __init__(self):
+        self.n_requests = 0
+        self.n_succeeded = 0
+        self.n_failed = 0
+        self.n_throttled = 0
+        self.n_retries = 0
+        self.error_codes = collections.Counter()
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    def observe(self, latency):
+        self.n_requests += 1
+        self.latency_sum += latency
+        self.latency_max = max(self.latency_max, latency)
+        for idx, upper_bound in enumerate(LATENCY_BUCKETS):
+            if latency <= upper_bound:
+                self.bucket_counts[idx] += 1
+                break
+
+    def quantile(self, q):
+        """
+        Estimates a latency quantile by interpolating within its histogram bucket
+        :param (float) q: quantile in [0, 1]
+        :return (float): latency in seconds
+        """
+        if not self.n_requests:
+            return 0.0
+        rank = q * self.n_requests
+        n_below = 0
+        lower_bound = 0.0
+        for count, upper_bound in zip(self.bucket_counts, LATENCY_BUCKETS):
+            if count and n_below + count >= rank:
+                upper_bound = min(upper_bound, self.latency_max)
+                return lower_bound + (upper_bound - lower_bound) * (rank - n_below) / count
+            n_below += count
+            lower_bound = upper_bound
+        return self.latency_max
+
+    def summary(self):
+        mean = self.latency_sum / self.n_requests if self.n_requests else 0.0
+        return {
+            'requests': self.n_requests,
+            'succeeded': self.n_succeeded,
+            'failed': self.n_failed,
+            'throttled': self.n_throttled,
+            'retries': self.n_retries,
+            'error_codes': dict(self.error_codes),
+            'latency_s': {
+                'mean': round(mean, 4),
+                'p50': round(self.quantile(0.5), 4),
+                'p90': round(self.quantile(0.9), 4),
+                'p99': round(self.quantile(0.99), 4),
+                'max': round(self.latency_max, 4),
+            },
+        }
+
+
+class MetricsCollector:
+    def __init__(self, action_name):
+        """
+        :param (str) action_name: name of the action the requests belong to
+        """
+        self.action_name = action_name
+        self.n_items = 0
+        self._operations = collections.defaultdict(OperationStats)
+        self._started = time.monotonic()
+        self._finished = None
+        self._lock = threading.Lock()
+
+    def record_request(self, operation, latency, error_code=None, throttled=False, retried=False):
+        """
+        Records a single attempt of a client call
+        :param (str) operation: client method name
+        :param (float) latency: seconds the call took
+        :param (str) error_code: AMT error code or exception name, None if the call succeeded
+        :param (bool) throttled: whether AMT rejected the call for exceeding its rate limit
+        :param (bool) retried: whether the call will be attempted again
+        """
+        with self._lock:
+            stats = self._operations[operation]
+            stats.observe(latency)
+            if error_code is None:
+                stats.n_succeeded += 1
+                return
+            stats.error_codes[error_code] += 1
+            if throttled:
+                stats.n_throttled += 1
+            if retried:
+                stats.n_retries += 1
+            else:
+                stats.n_failed += 1
+
+    def finish(self, n_items):
+        """
+        Stops the throughput clock
+        :param (int) n_items: number of items the action processed
+        """
+        self.n_items = n_items
+        self._finished = time.monotonic()
+
+    def elapsed(self):
+        return (self._finished or time.monotonic()) - self._started
+
+    def summary(self):
+        """
+        :return (dict): throughput and per operation request statistics
+        """
+        elapsed = self.elapsed()
+        with self._lock:
+            operations = {name: stats.summary() for name, stats in self._operations.items()}
+        return {
+            'action': self.action_name,
+            'elapsed_s': round(elapsed, 3),
+            'items': self.n_items,
+            'items_per_second': round(self.n_items / elapsed, 2) if elapsed else 0.0,
+            'operations': operations,
+        }
+
+    def to_prometheus(self):
+        """
+        :return (str): metrics in the Prometheus text exposition format
+        """
+        lines = [
+            '# TYPE amt_request_latency_seconds histogram',
+        ]
+        counters = collections.OrderedDict([
+            ('amt_requests_total', []),
+            ('amt_request_errors_total', []),
+            ('amt_request_retries_total', []),
+            ('amt_requests_throttled_total', []),
+        ])
+        with self._lock:
+            for name, stats in sorted(self._operations.items()):
+                labels = f'action="{self.action_name}",operation="{name}"'
+                n_cumulative = 0
+                for count, upper_bound in zip(stats.bucket_counts, LATENCY_BUCKETS):
+                    n_cumulative += count
+                    le = '+Inf' if math.isinf(upper_bound) else repr(upper_bound)
+                    lines.append(f'amt_request_latency_seconds_bucket{{{labels},le="{le}"}} {n_cumulative}')
+                lines.append(f'amt_request_latency_seconds_sum{{{labels}}} {stats.latency_sum}')
+                lines.append(f'amt_request_latency_seconds_count{{{labels}}} {stats.n_requests}')
+                counters['amt_requests_total'].append(f'{{{labels}}} {stats.n_requests}')
+                for code, count in sorted(stats.error_codes.items()):
+                    counters['amt_request_errors_total'].append(f'{{{labels},code="{code}"}} {count}')
+                counters['amt_request_retries_total'].append(f'{{{labels}}} {stats.n_retries}')
+                counters['amt_requests_throttled_total'].append(f'{{{labels}}} {stats.n_throttled}')
+        for metric, samples in counters.items():
+            lines.append(f'# TYPE {metric} counter')
+            lines.extend(metric + sample for sample in samples)
+        action_label = f'{{action="{self.action_name}"}}'
+        lines.append('# TYPE amt_action_items_per_second gauge')
+        lines.append(f'amt_action_items_per_second{action_label} {self.summary()["items_per_second"]}')
+        return '\n'.join(lines) + '\n'
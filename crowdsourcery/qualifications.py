@@ -6,7 +6,6 @@ Attributes:
 """
 from decorator import decorator
 
-amt_environment = 'sandbox'
 _MASTER_QUAL_IDS = {
     'production': '2F1QJWKUDD8XADTFD2Q0G6UTO95ALH',
     'sandbox': '2ARFPLSP75KLA8M8DH1HTEQVJT3SY6'
@@ -18,11 +17,10 @@ def build_qualifications(**kwargs):
     builds qualifications for task
     :return: list of qualification dicts
     """
-    global amt_environment
     qualifications = kwargs['qualifications']
     in_production = kwargs['amt_client_params']['in_production']
     amt_environment = 'production' if in_production else 'sandbox'
-    quals = [_qual_builder(qual)(setting) for qual, setting in qualifications.items()]
+    quals = [_qual_builder(qual)(setting, amt_environment) for qual, setting in qualifications.items()]
     return list(filter(None, quals))
 
 
@@ -32,20 +30,19 @@ def _qual_builder(qualification):
 
 @decorator
 def _check_qual_inclusion(qual_builder, *args, **kwargs):
-    setting = args[0]
+    setting, amt_environment = args[:2]
     if not setting or setting == 'false':
         return None
     if isinstance(setting, dict):
-        from copy import deepcopy
-        setting = deepcopy(setting)
+        setting = dict(setting)
         is_active = setting.pop('active', '')
         if is_active != amt_environment:
             return None
-    return qual_builder(setting)
+    return qual_builder(setting, amt_environment)
 
 
 @_check_qual_inclusion
-def _min_accept_rate(setting):
+def _min_accept_rate(setting, amt_environment):
     return {
         'QualificationTypeId': '000000000000000000L0',
         'Comparator': 'GreaterThanOrEqualTo',
@@ -55,7 +52,7 @@ def _min_accept_rate(setting):
 
 
 @_check_qual_inclusion
-def _min_total_hits_approved(setting):
+def _min_total_hits_approved(setting, amt_environment):
     return {
         'QualificationTypeId': '00000000000000000040',
         'Comparator': 'GreaterThanOrEqualTo',
@@ -65,7 +62,7 @@ def _min_total_hits_approved(setting):
 
 
 @_check_qual_inclusion
-def _master(_):
+def _master(_, amt_environment):
     master_qual_id = _MASTER_QUAL_IDS.get(amt_environment, '')
     if not master_qual_id:
         return None
@@ -77,7 +74,7 @@ def _master(_):
 
 
 @_check_qual_inclusion
-def _locales(setting):
+def _locales(setting, amt_environment):
     import iso3166
     allowed_locations = iso3166.countries_by_alpha2
     return {
@@ -89,5 +86,5 @@ def _locales(setting):
 
 
 @_check_qual_inclusion
-def _custom_qualification(settings):
+def _custom_qualification(settings, amt_environment):
     return settings
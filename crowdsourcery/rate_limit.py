@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Adaptive Rate Limiting
+
+A token bucket shared by every thread and coroutine talking to the same AMT endpoint.
+The refill rate follows AIMD: it creeps up while requests succeed and is cut
+multiplicatively whenever AMT throttles a request, so it settles near the real API limit.
+Until the first throttled request the rate doubles every second (slow start), so a
+conservative initial rate does not take minutes to ramp up.
+
+Attributes:
+     THROTTLING_ERROR_CODES (set): ClientError codes that indicate a throttled request
+"""
+import collections
+import random
+import threading
+import time
+
+THROTTLING_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(**kwargs):
+    """
+    Returns the process-wide limiter for a profile and environment, creating it on first use
+    : **kwargs: amt_client_params
+    :return (AdaptiveRateLimiter): shared limiter
+    """
+    key = (kwargs['profile_name'], kwargs.get('in_production', False))
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = AdaptiveRateLimiter(
+                rate=kwargs['rate_limit'],
+                max_rate=kwargs['max_rate_limit'],
+            )
+        return _limiters[key]
+
+
+def is_throttling_error(err):
+    """
+    :param err: botocore ClientError
+    :return (bool): whether AMT rejected the request for exceeding its rate limit
+    """
+    error = getattr(err, 'response', {}).get('Error', {})
+    message = error.get('Message', '').lower()
+    return error.get('Code') in THROTTLING_ERROR_CODES or 'rate exceeded' in message
+
+
+def backoff_delay(attempt, base_delay=0.25, max_delay=20.0):
+    """
+    Exponential backoff with full jitter
+    :param (int) attempt: number of previous attempts
+    :return (float): seconds to wait before retrying
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, rate, max_rate, min_rate=0.5, additive_increase=1.0,
+                 multiplicative_decrease=0.5, decrease_cooldown=1.0, window=500):
+        """
+        :param (float) rate: initial requests per second
+        :param (float) max_rate: ceiling on requests per second
+        :param (float) min_rate: floor on requests per second
+        :param (float) additive_increase: rate increase per second of unthrottled requests
+        :param (float) multiplicative_decrease: factor applied to the rate when throttled
+        :param (float) decrease_cooldown: minimum seconds between two rate decreases
+        :param (int) window: number of recent requests used to measure the sustained rate
+        """
+        self.rate = float(rate)
+        self.max_rate = float(max_rate)
+        self.min_rate = float(min_rate)
+        self.additive_increase = additive_increase
+        self.multiplicative_decrease = multiplicative_decrease
+        self.decrease_cooldown = decrease_cooldown
+        self.n_throttled = 0
+        self._slow_start = True
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._recent = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                capacity = max(1.0, self.rate)
+                self._tokens = min(capacity, self._tokens + (now - self._last_refill) * self.rate)
+                self._last_refill = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self._recent.append(now)
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            increase = 1.0 if self._slow_start else self.additive_increase / self.rate
+            self.rate = min(self.max_rate, self.rate + increase)
+
+    def on_throttle(self):
+        """
+        Cuts the rate at most once per cooldown, so the burst of throttled responses to
+        requests already in flight only counts as one congestion signal
+        """
+        with self._lock:
+            self.n_throttled += 1
+            self._slow_start = False
+            now = time.monotonic()
+            if now - self._last_decrease < self.decrease_cooldown:
+                return
+            self._last_decrease = now
+            self.rate = max(self.min_rate, self.rate * self.multiplicative_decrease)
+            self._tokens = 0.0
+
+    def sustained_rate(self):
+        """
+        :return (float): requests per second actually sent over the recent window
+        """
+        with self._lock:
+            if len(self._recent) < 2:
+                return 0.0
+            elapsed = self._recent[-1] - self._recent[0]
+            return (len(self._recent) - 1) / elapsed if elapsed else 0.0
+
+    def report(self):
+        """
+        :return (dict): current rate limit, measured request rate and throttle count
+        """
+        return {
+            'rate_limit': round(self.rate, 2),
+            'sustained_rate': round(self.sustained_rate(), 2),
+            'n_throttled': self.n_throttled,
+        }
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""HIT Rendering Pipeline
+
+Renders HIT params lazily so that rendering overlaps with the requests that send them.
+Render workers stay at most a few items ahead of the submit workers, keeping peak
+memory constant no matter how large the batch is.
+
+Rendering is CPU bound, so with interface_params.render_processes set it is done in a
+process pool instead of threads. Each worker process loads the template argument module
+and template once, and data is dispatched in chunks of interface_params.render_chunksize.
+"""
+import itertools
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor
+)
+from . import config
+from .html_hit import (
+    create_external_hit_params,
+    create_hit_params,
+    create_html_hit_params,
+    load_template,
+    render_hit_html
+)
+from .serialize import load_interface_arg_generator
+from .utils import bounded_imap
+
+_worker_state = {}
+
+
+def stream_hit_params(data, arg_gen, base_hit_params=None, external_url=None, **kwargs):
+    """
+    Lazily builds HIT params for every datum, in input order
+    :param data: task data, may be a lazy iterator
+    :param arg_gen: template argument generator
+    :param (BaseHitParams) base_hit_params: batch params, built from the configuration if not given
+    :param (str) external_url: hosted template page; if given, HITs are ExternalQuestions
+    and nothing is rendered per datum
+    : **kwargs: Arbitrary keyword arguments, must contain configuration
+    :return: generator of HIT params
+    """
+    interface_params = kwargs['configuration']['interface_params']
+    if not base_hit_params:
+        base_hit_params = create_hit_params(**kwargs)
+    if external_url:
+        for datum in data:
+            yield create_external_hit_params(base_hit_params, external_url, arg_gen(datum, **kwargs))
+        return
+    if interface_params['render_processes']:
+        yield from _stream_multiprocess(_build_hit_params_chunk, data, base_hit_params, **kwargs)
+        return
+
+    def build_hit_params(datum):
+        return create_html_hit_params(base_hit_params, **arg_gen(datum, **kwargs), **kwargs)
+
+    yield from _stream_threaded(build_hit_params, data, **kwargs)
+
+
+def stream_hit_html(data, arg_gen, **kwargs):
+    """
+    Lazily renders the template for every datum, in input order
+    :param data: task data, may be a lazy iterator
+    :param arg_gen: template argument generator
+    : **kwargs: Arbitrary keyword arguments, must contain configuration
+    :return: generator of rendered HTML
+    """
+    if kwargs['configuration']['interface_params']['render_processes']:
+        yield from _stream_multiprocess(_render_html_chunk, data, None, **kwargs)
+        return
+
+    def render_html(datum):
+        return render_hit_html(**arg_gen(datum, **kwargs), **kwargs)
+
+    yield from _stream_threaded(render_html, data, **kwargs)
+
+
+def _stream_threaded(build, data, **kwargs):
+    n_workers = kwargs['configuration']['interface_params']['render_workers']
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        yield from bounded_imap(build, data, executor, max_pending=2 * n_workers)
+
+
+def _stream_multiprocess(build_chunk, data, base_hit_params, **kwargs):
+    configuration = kwargs['configuration']
+    interface_params = configuration['interface_params']
+    n_processes = interface_params['render_processes']
+    chunks = _chunked(data, interface_params['render_chunksize'])
+    with ProcessPoolExecutor(max_workers=n_processes, initializer=_init_render_worker,
+                             initargs=(config.configuration_yml_fp, configuration, base_hit_params)) as executor:
+        for chunk_results in bounded_imap(build_chunk, chunks, executor, max_pending=2 * n_processes):
+            yield from chunk_results
+
+
+def stream_arg_keys(data, arg_gen, **kwargs):
+    """
+    Lazily runs the template argument generator for every datum, in input order, on the
+    same threads or process pool that render HITs
+    :param data: task data, may be a lazy iterator
+    :param arg_gen: template argument generator
+    : **kwargs: Arbitrary keyword arguments, must contain configuration
+    :return: generator of the frozenset of argument names generated for each datum
+    """
+    if kwargs['configuration']['interface_params']['render_processes']:
+        yield from _stream_multiprocess(_arg_keys_chunk, data, None, **kwargs)
+        return
+
+    def arg_keys(datum):
+        return frozenset(arg_gen(datum, **kwargs))
+
+    yield from _stream_threaded(arg_keys, data, **kwargs)
+
+
+def _init_render_worker(configuration_yml_fp, configuration, base_hit_params):
+    """
+    Runs once in every render process
+    """
+    config.configuration_yml_fp = configuration_yml_fp
+    kwargs = {'configuration': configuration}
+    _worker_state['kwargs'] = kwargs
+    _worker_state['base_hit_params'] = base_hit_params
+    _worker_state['arg_gen'] = load_interface_arg_generator(**kwargs)
+    load_template(**kwargs)
+
+
+def _build_hit_params_chunk(chunk):
+    kwargs = _worker_state['kwargs']
+    arg_gen = _worker_state['arg_gen']
+    base_hit_params = _worker_state['base_hit_params']
+    return [create_html_hit_params(base_hit_params, **arg_gen(datum, **kwargs), **kwargs) for datum in chunk]
+
+
+def _arg_keys_chunk(chunk):
+    kwargs = _worker_state['kwargs']
+    arg_gen = _worker_state['arg_gen']
+    return [frozenset(arg_gen(datum, **kwargs)) for datum in chunk]
+
+
+def _render_html_chunk(chunk):
+    kwargs = _worker_state['kwargs']
+    arg_gen = _worker_state['arg_gen']
+    return [render_hit_html(**arg_gen(datum, **kwargs), **kwargs) for datum in chunk]
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
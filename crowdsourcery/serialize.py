@@ -1,7 +1,14 @@
+import array
+import functools
+import hashlib
 import json
 import gzip
+import io
+import itertools
 import pickle
 import os
+import tempfile
+import threading
 import importlib.util
 from decorator import decorator
 from .config import configure
@@ -15,48 +22,128 @@ def serialize_action_result(action, *args, **kwargs):
     configs = kwargs['configuration']
     output_format = configs['serialization_params']['output_format']
     output_fp = prepare_output_path(action, configs)
-    compress = configs['serialization_params']['compress']
     res = action(*args, **kwargs)
-    serialize_result(res, output_format, output_fp, compress=compress)
+    serialize_result(res, output_format, output_fp, **_compression_params(configs))
     logger.info('%s results written to %s', action.__name__, output_fp)
     return res
 
 
-def serialize_result(result, output_format, output_fp, compress=False):
+def serialize_result(result, output_format, output_fp, compress=False, codec='gzip', compress_level=None):
+    """
+    :param (bool) compress: compress the output as it is written
+    :param (str) codec: compression codec, one of gzip, bz2, lzma or zstd
+    :param (int) compress_level: codec specific level, None for the codec's default
+    """
     available_serializers = {
         'json': _dump_json,
+        'jsonl': _dump_jsonl,
         'pickle': _dump_pickle
     }
     serializer = available_serializers.get(output_format, None)
-    serializer(result, output_fp, compress)
+    serializer(result, output_fp, compress, codec=codec, compress_level=compress_level)
+
+
+def _compression_params(configs):
+    serialization_params = configs['serialization_params']
+    return {
+        'compress': serialization_params['compress'],
+        'codec': serialization_params['codec'],
+        'compress_level': serialization_params['compress_level'],
+    }
 
 
 @configure
-def deserialize_result(input_fp, **kwargs):
+def deserialize_result(input_fp, lazy=False, **kwargs):
+    """
+    :param input_fp: path to a serialized result
+    :param (bool) lazy: for jsonl results, return a generator of records instead of a list
+    :return: deserialized result
+    """
     configs = kwargs['configuration']
     available_deserializers = {
         'json': _load_json,
+        'jsonl': functools.partial(_load_jsonl, lazy=lazy),
         'pickle': _load_pickle
     }
     output_format = configs['serialization_params']['output_format']
     deserializer = available_deserializers.get(output_format, None)
     if deserializer:
-        return deserializer(input_fp, compress=configs['serialization_params']['compress'])
+        return deserializer(input_fp)
     return None
 
 
-def _read(file_name, mode='rb'):
-    with open(file_name, mode) as file:
-        return file.read()
+_JSONL_MAPPING_MARKER = {'__jsonl_mapping__': 1}
+_CODECS = {
+    'gzip': ('gz', b'\x1f\x8b', 6),
+    'bz2': ('bz2', b'BZh', 9),
+    'lzma': ('xz', b'\xfd7zXZ\x00', 6),
+    'zstd': ('zst', b'\x28\xb5\x2f\xfd', 3),
+}
+
+
+def _open_codec(codec, file_name, mode, compress_level=None):
+    """
+    Opens a binary stream that compresses on write or decompresses on read
+    :param (str) codec: one of gzip, bz2, lzma or zstd
+    :param (str) mode: rb or wb
+    :param (int) compress_level: codec specific level, None for the codec's default
+    :return: binary file object
+    """
+    if compress_level is None:
+        compress_level = _CODECS[codec][2]
+    if codec == 'gzip':
+        return gzip.open(file_name, mode, compresslevel=compress_level)
+    if codec == 'bz2':
+        import bz2
+        return bz2.open(file_name, mode, compresslevel=compress_level)
+    if codec == 'lzma':
+        import lzma
+        return lzma.open(file_name, mode, preset=compress_level if 'w' in mode else None)
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('the zstandard package is required for zstd compression')
+        if 'w' in mode:
+            return zstandard.open(file_name, mode, cctx=zstandard.ZstdCompressor(level=compress_level))
+        return zstandard.open(file_name, mode)
+    raise NotImplementedError(f'{codec} is not an available compression codec')
+
+
+def _open_output(file_name, compress=False, codec='gzip', compress_level=None):
+    """
+    :return: binary file object, compressed with codec if compress is set, in which case
+    the codec's extension is appended to file_name
+    """
+    if not compress:
+        return open(file_name, 'wb')
+    return _open_codec(codec, f'{file_name}.{_CODECS[codec][0]}', 'wb', compress_level)
 
 
-def _write(file_name, data, mode='wb'):
-    with open(file_name, mode) as file:
-        file.write(data)
+def _open_input(file_name):
+    """
+    :return: binary file object, decompressed if its first bytes match a known codec
+    """
+    with open(file_name, 'rb') as file:
+        header = file.read(6)
+    for codec, (_, magic, _) in _CODECS.items():
+        if header.startswith(magic):
+            return _open_codec(codec, file_name, 'rb')
+    return open(file_name, 'rb')
 
 
-def _write_compressed(file_name, data, compress_level):
-    _write(f'{file_name}.gz', gzip.compress(data, compresslevel=compress_level))
+def _find_input(file_name, file_ext):
+    """
+    Resolves a result path given with or without its format and compression extensions
+    """
+    if os.path.isfile(file_name):
+        return file_name
+    file_name = _append_file_ext(file_name, file_ext)
+    candidates = [file_name] + [f'{file_name}.{ext}' for ext, _, _ in _CODECS.values()]
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    raise FileNotFoundError(f'no {file_ext} file found at {file_name}')
 
 
 def _append_file_ext(file_name, file_ext):
@@ -65,63 +152,319 @@ def _append_file_ext(file_name, file_ext):
     return file_name
 
 
-def _load_json(file_name, compress):
-    file_name = _append_file_ext(file_name, 'json')
-    if compress:
-        return json.loads(gzip.decompress(_read(file_name)).decode('utf8'))
-    return json.loads(_read(file_name, 'r'))
+def _load_json(file_name, compress=None):
+    """
+    :param compress: unused, compression is detected from the file
+    """
+    with _open_input(_find_input(file_name, 'json')) as file:
+        return json.load(file)
 
 
-def _dump_json(dump_object, file_name, compress, indent=4, compress_level=9):
+def _dump_json(dump_object, file_name, compress, indent=4, codec='gzip', compress_level=None):
     file_name = _append_file_ext(file_name, 'json')
     if compress:
         data = json.dumps(dump_object, sort_keys=True, default=str)
-        _write_compressed(file_name, data.encode('utf8'), compress_level)
     else:
         data = json.dumps(dump_object, sort_keys=True, indent=indent, default=str)
-        _write(file_name, data, 'w')
+    with _open_output(file_name, compress, codec, compress_level) as file:
+        file.write(data.encode('utf8'))
     return dump_object
 
 
-def _load_pickle(file_name, compress):
-    file_name = _append_file_ext(file_name, 'pkl')
-    data = _read(file_name)
-    if compress:
-        load_object = pickle.loads(gzip.decompress(data))
+def _load_jsonl(file_name, compress=None, lazy=False):
+    """
+    :param compress: unused, compression is detected from the file
+    :param (bool) lazy: return a generator that reads one record at a time, a mapping
+    is then read as (key, value) pairs
+    :return: list or generator of records, or the mapping written by _dump_jsonl
+    """
+    records = _iter_jsonl(_find_input(file_name, 'jsonl'))
+    first_record = next(records, None)
+    if first_record == _JSONL_MAPPING_MARKER:
+        entries = ((record['key'], record['value']) for record in records)
+        return entries if lazy else dict(entries)
+    if first_record is not None:
+        records = itertools.chain([first_record], records)
+    return records if lazy else list(records)
+
+
+def _iter_jsonl(file_name):
+    with io.TextIOWrapper(_open_input(file_name), encoding='utf8') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _dump_jsonl(dump_object, file_name, compress, codec='gzip', compress_level=None):
+    """
+    Writes one record per line as it is serialized, so the whole output is never held
+    in memory as a single string. Mappings are written as a marker record followed by one
+    {"key": key, "value": value} record per entry, so they load back as mappings.
+    """
+    file_name = _append_file_ext(file_name, 'jsonl')
+    if isinstance(dump_object, dict):
+        records = itertools.chain([_JSONL_MAPPING_MARKER],
+                                  ({'key': key, 'value': val} for key, val in dump_object.items()))
     else:
-        load_object = pickle.loads(data)
-    return load_object
+        records = dump_object
+    output = _open_output(file_name, compress, codec, compress_level)
+    with io.TextIOWrapper(output, encoding='utf8') as file:
+        for record in records:
+            file.write(json.dumps(record, default=str))
+            file.write('\n')
+    return dump_object
+
 
+def _load_pickle(file_name, compress=None):
+    """
+    :param compress: unused, compression is detected from the file
+    """
+    with _open_input(_find_input(file_name, 'pkl')) as file:
+        return pickle.load(file)
 
-def _dump_pickle(dump_object, file_name, compress, compress_level=9):
+
+def _dump_pickle(dump_object, file_name, compress, codec='gzip', compress_level=None):
     file_name = _append_file_ext(file_name, 'pkl')
-    data = pickle.dumps(dump_object)
-    if compress:
-        _write_compressed(file_name, data, compress_level)
-    else:
-        _write(file_name, data)
+    with _open_output(file_name, compress, codec, compress_level) as file:
+        pickle.dump(dump_object, file, protocol=pickle.HIGHEST_PROTOCOL)
     return dump_object
 
 
+class JsonLinesWriter:
+    """
+    Thread-safe appender of one JSON record per line. The file is only created once the
+    first record is written. With fsync, every record is on disk before write returns,
+    so the file survives the process dying mid-batch.
+    """
+    def __init__(self, file_name, fsync=False):
+        self.file_name = file_name
+        self.n_written = 0
+        self._fsync = fsync
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            if not self._file:
+                self._file = open(self.file_name, 'a')
+            self._file.write(line)
+            self._file.flush()
+            if self._fsync:
+                os.fsync(self._file.fileno())
+            self.n_written += 1
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_json_lines(file_name):
+    """
+    Lazily reads records written by JsonLinesWriter. A final line left incomplete by a
+    crash is skipped.
+    :param file_name: JSON lines file
+    :return: generator of records
+    """
+    with open(file_name) as file:
+        for line in file:
+            if not line.endswith('\n'):
+                break
+            yield json.loads(line)
+
+
+class JsonLinesDataset:
+    """
+    Read-only sequence of the records in a JSON lines file, optionally compressed. Records
+    are only read when needed: iterating streams the file, and indexing seeks to the
+    record's byte offset. Offsets are stored in an index file next to the data, built on
+    first random access and rebuilt when the data file changes. Compressed files can be
+    indexed too, but every seek decompresses from the start of the file.
+    """
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.index_fp = file_name + '.idx'
+        self._offsets = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return _iter_jsonl(self.file_name)
+
+    def __len__(self):
+        return len(self._load_offsets())
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        offsets = self._load_offsets()
+        if idx < 0:
+            idx += len(offsets)
+        if not 0 <= idx < len(offsets):
+            raise IndexError('record index out of range')
+        with self._lock:
+            if not self._file:
+                self._file = _open_input(self.file_name)
+            self._file.seek(offsets[idx])
+            line = self._file.readline()
+        return json.loads(line)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def __getstate__(self):
+        return {'file_name': self.file_name, 'index_fp': self.index_fp, '_offsets': self._offsets}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, _file=None, _lock=threading.Lock())
+
+    def _load_offsets(self):
+        if self._offsets is None:
+            with self._lock:
+                if self._offsets is None:
+                    offsets = self._read_index()
+                    self._offsets = offsets if offsets is not None else self._build_index()
+        return self._offsets
+
+    def _read_index(self):
+        if not os.path.exists(self.index_fp) or \
+                os.path.getmtime(self.index_fp) < os.path.getmtime(self.file_name):
+            return None
+        offsets = array.array('q')
+        with open(self.index_fp, 'rb') as file:
+            offsets.frombytes(file.read())
+        return offsets
+
+    def _build_index(self):
+        offsets = array.array('q')
+        offset = 0
+        with _open_input(self.file_name) as file:
+            for line in file:
+                if line.strip():
+                    offsets.append(offset)
+                offset += len(line)
+        try:
+            with open(self.index_fp, 'wb') as file:
+                offsets.tofile(file)
+        except OSError:
+            pass
+        return offsets
+
+
 def load_input_data(data_fp, compress=False):
+    """
+    Loads task data. JSON lines (.jsonl or .ndjson) data is not read into memory but
+    returned as a JsonLinesDataset.
+    :param compress: unused, compression is detected from the file
+    """
     available_deserializers = {
         'json': _load_json,
+        'jsonl': lambda file_name, _: JsonLinesDataset(file_name),
+        'ndjson': lambda file_name, _: JsonLinesDataset(file_name),
         'pkl': _load_pickle
     }
-    file_ext = os.path.splitext(data_fp)[-1].replace('.', '')
+    file_name, file_ext = os.path.splitext(data_fp)
+    if file_ext.replace('.', '') in {ext for ext, _, _ in _CODECS.values()}:
+        file_ext = os.path.splitext(file_name)[-1]
+    file_ext = file_ext.replace('.', '')
     data_loader = available_deserializers.get(file_ext, None)
     if not data_loader:
         raise NotImplementedError
     return data_loader(data_fp, compress)
 
 
+_SPOOL_PREFIX = '.spool--input_data--'
+
+
+def spool_input_data(data, **kwargs):
+    """
+    Streams data without random access, e.g. an iterator, into a temporary JSON lines
+    file in the batch output directory, so it can be counted and read again before a
+    launch is confirmed. record_input_data moves the file into the record, and
+    discard_spooled_data removes it if the launch is abandoned.
+    :param data: task data
+    :return (JsonLinesDataset): spooled data
+    """
+    output_dir = os.path.dirname(prepare_output_path('record--input_data', kwargs['configuration']))
+    spool_fd, spool_fp = tempfile.mkstemp(prefix=_SPOOL_PREFIX, suffix='.jsonl', dir=output_dir)
+    os.close(spool_fd)
+    _dump_jsonl(data, spool_fp, compress=False)
+    return JsonLinesDataset(spool_fp)
+
+
+def discard_spooled_data(dataset):
+    """
+    :param (JsonLinesDataset) dataset: data from spool_input_data
+    :return: None
+    """
+    dataset.close()
+    for file_name in (dataset.file_name, dataset.index_fp):
+        if os.path.exists(file_name):
+            os.remove(file_name)
+
+
+def _is_spooled(data):
+    return isinstance(data, JsonLinesDataset) and os.path.basename(data.file_name).startswith(_SPOOL_PREFIX)
+
+
+def _file_sha256(file_name):
+    file_hash = hashlib.sha256()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(functools.partial(file.read, 1 << 20), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
 def record_input_data(data, **kwargs):
+    """
+    Records the input data of a launch. Spooled data is moved into the record. Data read
+    from a JSON lines file is recorded by reference, as the file's path, size and sha256
+    hash, rather than copied. Other data that is not a list, e.g. an iterator, is streamed
+    into an uncompressed JSON lines record, which is returned as a JsonLinesDataset so a
+    one-shot iterator can be read again.
+    :param data: task data
+    :return: data, or the JsonLinesDataset of the record
+    """
     configs = kwargs['configuration']
     output_format = configs['serialization_params']['output_format']
     output_fp = prepare_output_path('record--input_data', configs)
-    compress = configs['serialization_params']['compress']
-    serialize_result(data, output_format, output_fp, compress=compress)
     from .log import logger
+    if _is_spooled(data):
+        data.close()
+        output_fp = _append_file_ext(output_fp, 'jsonl')
+        os.replace(data.file_name, output_fp)
+        if os.path.exists(data.index_fp):
+            os.replace(data.index_fp, output_fp + '.idx')
+        data.file_name, data.index_fp = output_fp, output_fp + '.idx'
+        logger.info('recording HIT creation input data at %s', output_fp)
+        return data
+    if isinstance(data, JsonLinesDataset):
+        output_fp = _append_file_ext(output_fp, 'json')
+        _dump_json({
+            'file_name': os.path.abspath(data.file_name),
+            'size_bytes': os.path.getsize(data.file_name),
+            'sha256': _file_sha256(data.file_name),
+            'records': len(data),
+        }, output_fp, compress=False)
+        logger.info('recording reference to HIT creation input data %s at %s', data.file_name, output_fp)
+        return data
+    if not isinstance(data, (list, tuple, dict)):
+        output_fp = _append_file_ext(output_fp, 'jsonl')
+        _dump_jsonl(data, output_fp, compress=False)
+        logger.info('recording HIT creation input data at %s', output_fp)
+        return JsonLinesDataset(output_fp)
+    serialize_result(data, output_format, output_fp, **_compression_params(configs))
     logger.info('recording HIT creation input data at %s', output_fp)
     return data
 
@@ -154,22 +497,28 @@ def record_template_generator(template_gen_fp, **kwargs):
 
 def load_interface_arg_generator(record=False, **kwargs):
     """
-
-    :param record:
+    Loads the template argument function set in interface_params. Loaded functions are
+    cached per process by module path, modification time and function name, so the
+    module is only executed again when it changes.
+    :param record: copy the module to the output directory
     :param kwargs:
-    :return:
+    :return: template argument function
     """
     interface_params = kwargs['configuration']['interface_params']
     module_path = interface_params['template_arg_module']
     if record:
         record_template_generator(module_path, **kwargs)
-    module_name = module_path.split('/')[-1].replace('.py', '')
     func_name = interface_params['template_arg_function']
+    return _load_arg_generator(module_path, os.path.getmtime(module_path), func_name)
+
+
+@functools.lru_cache(maxsize=32)
+def _load_arg_generator(module_path, module_mtime, func_name):
+    """
+    :param module_mtime: only used as part of the cache key
+    """
+    module_name = module_path.split('/')[-1].replace('.py', '')
     mod_spec = importlib.util.spec_from_file_location(module_name, module_path)
     task_spec_func = importlib.util.module_from_spec(mod_spec)
     mod_spec.loader.exec_module(task_spec_func)
     return getattr(task_spec_func, func_name)
-
-
-
-
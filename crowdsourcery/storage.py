@@ -6,8 +6,9 @@ import os
 import io
 import base64
 import json
-import boto3
+import urllib.parse
 from pprint import pprint
+from .amt_client import get_client
 from .config import configure
 
 
@@ -21,9 +22,63 @@ def _create_bucket(bucket_name, **kwargs):
 
 
 def _create_s3_client(**kwargs):
+    local_storage_dir = kwargs['configuration']['experiment_params'].get('local_storage_dir', None)
+    if local_storage_dir:
+        return LocalBucketClient(local_storage_dir)
     profile_name = kwargs['configuration']['amt_client_params']['s3_profile_name']
-    session = boto3.Session(profile_name=profile_name)
-    return session.client(service_name='s3')
+    return get_client('s3', profile_name)
+
+
+class LocalBucketClient:
+    """
+    Local stand-in for the subset of the S3 client used here, selected by setting
+    experiment_params.local_storage_dir. Buckets are directories below local_storage_dir.
+    """
+    def __init__(self, local_storage_dir):
+        self.local_storage_dir = local_storage_dir
+
+    def _path(self, bucket, key):
+        return os.path.join(self.local_storage_dir, bucket, key)
+
+    def create_bucket(self, Bucket):
+        os.makedirs(self._path(Bucket, ''), exist_ok=True)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None):
+        import shutil
+        obj_path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+        shutil.copy(Filename, obj_path)
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None):
+        obj_path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(obj_path), exist_ok=True)
+        with open(obj_path, 'wb') as file:
+            file.write(Fileobj.read())
+
+    def get_object(self, Bucket, Key):
+        with open(self._path(Bucket, Key), 'rb') as file:
+            return {'Body': io.BytesIO(file.read())}
+
+    def list_objects_v2(self, Bucket, Prefix='', **kwargs):
+        import datetime
+        bucket_dir = self._path(Bucket, '')
+        contents = []
+        for dir_path, _, file_names in os.walk(bucket_dir):
+            for file_name in file_names:
+                obj_path = os.path.join(dir_path, file_name)
+                key = os.path.relpath(obj_path, bucket_dir)
+                if key.startswith(Prefix):
+                    contents.append({
+                        'Key': key,
+                        'Size': os.path.getsize(obj_path),
+                        'LastModified': datetime.datetime.fromtimestamp(os.path.getmtime(obj_path)),
+                        'ETag': '',
+                        'StorageClass': 'LOCAL',
+                    })
+        return {'Contents': contents}
+
+    def object_url(self, Bucket, Key):
+        return 'file://' + os.path.abspath(self._path(Bucket, Key))
 
 
 @configure
@@ -79,17 +134,26 @@ def list_working_folder(display_meta_data=False, **kwargs):
 
 
 @configure
-def upload_object(obj_fp, obj=None, **kwargs):
+def upload_object(obj_fp, obj=None, extra_args=None, **kwargs):
+    """
+    :param obj_fp: file to upload, its name is used for the object key
+    :param obj: JSON serializable object to upload instead of the file's contents
+    :param extra_args: S3 ExtraArgs, e.g. ContentType
+    :return: URL of the uploaded object
+    """
     s3_client = _create_s3_client(**kwargs)
     obj_name = os.path.split(obj_fp)[-1]
     bucket_name, path_prefix, obj_key = build_object_path(obj_name, **kwargs)
     if obj:
         bin_obj_f = _prepare_json_for_s3_upload(obj)
-        resp = s3_client.upload_fileobj(bin_obj_f, bucket_name, obj_key)
+        resp = s3_client.upload_fileobj(bin_obj_f, bucket_name, obj_key, ExtraArgs=extra_args)
     else:
-        resp = s3_client.upload_file(obj_fp, bucket_name, obj_key)
+        resp = s3_client.upload_file(obj_fp, bucket_name, obj_key, ExtraArgs=extra_args)
     # confirm_upload = list(list_objects(bucket_name, path_prefix, **kwargs))
     # return confirm_upload
+    if isinstance(s3_client, LocalBucketClient):
+        return s3_client.object_url(bucket_name, obj_key)
+    return f'https://{bucket_name}.s3.amazonaws.com/{urllib.parse.quote(obj_key)}'
 
 
 @configure
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""Local Store
+
+A SQLite database of every HIT, assignment and extracted result the management actions
+have seen, kept up to date as actions run. Rows are indexed by id, batch, worker and
+status, so questions like "which HITs are still Assignable" are answered without
+deserializing whole result files. The full AMT record is kept as JSON next to the
+indexed columns.
+
+Attributes:
+     STATUS_UPDATES (dict): status set by an action on the items it succeeded for,
+     keyed by action name, as (table, id field, status)
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from .config import configure
+
+STATUS_UPDATES = {
+    'ApproveAssignments': ('assignments', 'AssignmentId', 'Approved'),
+    'DeleteHits': ('hits', 'HITId', 'Disposed'),
+    'UpdateHITsReviewStatus': ('hits', 'HITId', 'Reviewing'),
+}
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS hits (
+    HITId TEXT PRIMARY KEY,
+    batch_id TEXT,
+    HITTypeId TEXT,
+    status TEXT,
+    updated_at REAL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS hits_batch_status ON hits (batch_id, status);
+CREATE INDEX IF NOT EXISTS hits_status ON hits (status);
+CREATE TABLE IF NOT EXISTS assignments (
+    AssignmentId TEXT PRIMARY KEY,
+    HITId TEXT,
+    WorkerId TEXT,
+    batch_id TEXT,
+    status TEXT,
+    updated_at REAL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS assignments_hit ON assignments (HITId);
+CREATE INDEX IF NOT EXISTS assignments_worker ON assignments (WorkerId);
+CREATE INDEX IF NOT EXISTS assignments_batch_status ON assignments (batch_id, status);
+CREATE INDEX IF NOT EXISTS assignments_status ON assignments (status);
+CREATE TABLE IF NOT EXISTS results (
+    globalID TEXT,
+    batch_id TEXT,
+    updated_at REAL,
+    data TEXT,
+    PRIMARY KEY (batch_id, globalID)
+);
+'''
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+def _store_path(configs):
+    serialization_params = configs['serialization_params']
+    return serialization_params['store_fp'] or os.path.join(serialization_params['output_dir_base'],
+                                                            'store.sqlite3')
+
+
+def _connect(configs):
+    """
+    :return: connection to the store, creating the database and its tables on first use
+    """
+    store_fp = _store_path(configs)
+    with _init_lock:
+        if store_fp not in _initialized:
+            os.makedirs(os.path.dirname(store_fp) or '.', exist_ok=True)
+            with closing(sqlite3.connect(store_fp, timeout=30)) as conn:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(_SCHEMA)
+            _initialized.add(store_fp)
+    conn = sqlite3.connect(store_fp, timeout=30)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+@configure
+def upsert_records(records, in_batch=True, **kwargs):
+    """
+    Adds or updates the HITs and assignments in AMT responses. HITs and assignments keep
+    the batch they were first stored under.
+    :param records: list of HITs, create_hit/get_hit responses, assignments or
+    list_assignments_for_hit responses, or a single response
+    :param (bool) in_batch: whether the records belong to the configured batch. Otherwise,
+    e.g. for every HIT of the account, new rows are stored without a batch, which a later
+    action in their batch fills in
+    :return (tuple): number of HITs and assignments stored
+    """
+    configs = kwargs['configuration']
+    if not configs['serialization_params']['store'] or not records:
+        return 0, 0
+    batch_id = configs['experiment_params']['batch_id'] if in_batch else None
+    now = time.time()
+    hits, assignments = [], []
+    if isinstance(records, dict):
+        records = [records]
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        hit = record.get('HIT', record if 'HITStatus' in record else None)
+        if hit:
+            hits.append((hit['HITId'], batch_id, hit.get('HITTypeId', None), hit.get('HITStatus', None),
+                         now, json.dumps(hit, default=str)))
+        for asg in record.get('Assignments', [record] if 'AssignmentId' in record else []):
+            assignments.append((asg['AssignmentId'], asg.get('HITId', None), asg.get('WorkerId', None),
+                                batch_id, asg.get('AssignmentStatus', None), now, json.dumps(asg, default=str)))
+    with closing(_connect(configs)) as conn, conn:
+        conn.executemany('''
+            INSERT INTO hits VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (HITId) DO UPDATE SET
+                batch_id = COALESCE(hits.batch_id, excluded.batch_id),
+                HITTypeId = excluded.HITTypeId, status = excluded.status,
+                updated_at = excluded.updated_at, data = excluded.data
+        ''', hits)
+        conn.executemany('''
+            INSERT INTO assignments VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (AssignmentId) DO UPDATE SET
+                batch_id = COALESCE(assignments.batch_id, excluded.batch_id), HITId = excluded.HITId, WorkerId = excluded.WorkerId, status = excluded.status,
+                updated_at = excluded.updated_at, data = excluded.data
+        ''', assignments)
+    return len(hits), len(assignments)
+
+
+@configure
+def upsert_results(results, **kwargs):
+    """
+    Adds or updates the task results extracted from a batch's assignments
+    :param (dict) results: task results keyed on their globalID
+    :return (int): number of results stored
+    """
+    configs = kwargs['configuration']
+    if not configs['serialization_params']['store'] or not results:
+        return 0
+    batch_id = configs['experiment_params']['batch_id']
+    now = time.time()
+    rows = [(str(global_id), batch_id, now, json.dumps(res, default=str)) for global_id, res in results.items()]
+    with closing(_connect(configs)) as conn, conn:
+        conn.executemany('''
+            INSERT INTO results VALUES (?, ?, ?, ?)
+            ON CONFLICT (batch_id, globalID) DO UPDATE SET
+                updated_at = excluded.updated_at, data = excluded.data
+        ''', rows)
+    return len(rows)
+
+
+@configure
+def record_action(action_name, batch, results, **kwargs):
+    """
+    Stores the records returned by an amt_multi_action, and the status its successful
+    requests set on the HITs or assignments they were made for
+    :param (str) action_name: BotoThreadedOperation name
+    :param batch: items the action was performed on
+    :param results: (index, response) pairs
+    :return: None
+    """
+    configs = kwargs['configuration']
+    if not configs['serialization_params']['store']:
+        return
+    upsert_records([res for _, res in results], **kwargs)
+    if action_name not in STATUS_UPDATES or not hasattr(batch, '__getitem__'):
+        return
+    table, id_field, status = STATUS_UPDATES[action_name]
+    if action_name == 'UpdateHITsReviewStatus' and kwargs.get('revert', False):
+        status = 'Reviewable'
+    updated = [(status, time.time(), batch[idx][id_field]) for idx, res in results
+               if res is not None and id_field in batch[idx]]
+    with closing(_connect(configs)) as conn, conn:
+        conn.executemany(f'UPDATE {table} SET status = ?, updated_at = ? WHERE {id_field} = ?', updated)
+
+
+def _where(batch_id, **filters):
+    clauses, params = [], []
+    if batch_id != '*':
+        clauses.append('batch_id = ?')
+        params.append(batch_id)
+    for column, value in filters.items():
+        if value is not None:
+            clauses.append(f'{column} = ?')
+            params.append(value)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+@configure
+def query_hits(status=None, batch_id=None, hit_type_id=None, **kwargs):
+    """
+    :param status: HITStatus to match, e.g. Assignable
+    :param batch_id: batch to search, None for the configured batch, * for every batch
+    :param hit_type_id: HITTypeId to match
+    :return (list): stored HITs
+    """
+    configs = kwargs['configuration']
+    batch_id = batch_id or configs['experiment_params']['batch_id']
+    where, params = _where(batch_id, status=status, HITTypeId=hit_type_id)
+    with closing(_connect(configs)) as conn:
+        return [json.loads(row[0]) for row in conn.execute('SELECT data FROM hits' + where, params)]
+
+
+@configure
+def query_assignments(status=None, batch_id=None, hit_id=None, worker_id=None, **kwargs):
+    """
+    :param status: AssignmentStatus to match, e.g. Submitted
+    :param batch_id: batch to search, None for the configured batch, * for every batch
+    :param hit_id: HITId to match
+    :param worker_id: WorkerId to match
+    :return (list): stored assignments
+    """
+    configs = kwargs['configuration']
+    batch_id = batch_id or configs['experiment_params']['batch_id']
+    where, params = _where(batch_id, status=status, HITId=hit_id, WorkerId=worker_id)
+    with closing(_connect(configs)) as conn:
+        return [json.loads(row[0]) for row in conn.execute('SELECT data FROM assignments' + where, params)]
+
+
+@configure
+def query_results(batch_id=None, **kwargs):
+    """
+    :param batch_id: batch to search, None for the configured batch
+    :return (dict): stored task results keyed on their globalID
+    """
+    configs = kwargs['configuration']
+    batch_id = batch_id or configs['experiment_params']['batch_id']
+    with closing(_connect(configs)) as conn:
+        rows = conn.execute('SELECT globalID, data FROM results WHERE batch_id = ?', (batch_id,))
+        return {global_id: json.loads(data) for global_id, data in rows}
+
+
+@configure
+def status_counts(table='hits', batch_id=None, **kwargs):
+    """
+    :param (str) table: hits or assignments
+    :param batch_id: batch to count, None for the configured batch, * for every batch
+    :return (dict): number of stored rows per status
+    """
+    if table not in ('hits', 'assignments'):
+        raise ValueError(f'{table} is not a stored table, must be hits or assignments')
+    configs = kwargs['configuration']
+    batch_id = batch_id or configs['experiment_params']['batch_id']
+    where, params = _where(batch_id)
+    with closing(_connect(configs)) as conn:
+        rows = conn.execute(f'SELECT status, COUNT(*) FROM {table}{where} GROUP BY status', params)
+        return dict(rows.fetchall())
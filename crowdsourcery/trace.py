@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Request Tracing
+
+Opt-in JSON lines trace of every call made to AMT, one line per attempt, enabled with
+amt_client_params.trace_requests. Traces are written next to the action's results, and
+analyze_trace rebuilds the run's concurrency timeline from them to show where the time
+went: stragglers, stalls when nothing was in flight, and how busy each thread was.
+"""
+import contextlib
+import json
+import statistics
+import threading
+import time
+
+
+def open_trace(action_name, configs):
+    """
+    :param (str) action_name: name of the traced action
+    :param configs: configuration
+    :return: JsonLinesWriter for the trace if tracing is enabled, otherwise a context that yields None
+    """
+    if not configs['amt_client_params']['trace_requests']:
+        return contextlib.nullcontext()
+    from .serialize import JsonLinesWriter
+    from .utils import prepare_output_path
+    return JsonLinesWriter(prepare_output_path('trace--' + action_name, configs) + '.jsonl')
+
+
+def trace_call(trace, operation, request, latency, response=None, outcome='ok', attempt=0):
+    """
+    Writes a single call to the trace
+    :param (JsonLinesWriter) trace: trace writer
+    :param (str) operation: client method name
+    :param (dict) request: call params
+    :param (float) latency: seconds the call took, measured by the caller
+    :param response: AMT response, used to find the HIT of create calls
+    :param (str) outcome: ok, throttled, or the error code
+    :param (int) attempt: number of earlier attempts of this request
+    :return: None
+    """
+    end = time.time()
+    hit = response.get('HIT', {}) if isinstance(response, dict) else {}
+    trace.write({
+        'operation': operation,
+        'HITId': request.get('HITId', hit.get('HITId', None)),
+        'AssignmentId': request.get('AssignmentId', None),
+        'thread': threading.current_thread().name,
+        'start': round(end - latency, 6),
+        'end': round(end, 6),
+        'request_bytes': len(json.dumps(request, default=str)),
+        'outcome': outcome,
+        'attempt': attempt,
+    })
+
+
+def analyze_trace(trace_fp, straggler_factor=5.0, stall_seconds=2.0, n_stragglers=10):
+    """
+    Rebuilds the concurrency timeline of a traced run
+    :param trace_fp: path to a trace file
+    :param (float) straggler_factor: calls slower than this multiple of their operation's
+    median latency are stragglers
+    :param (float) stall_seconds: gaps of at least this long with no call in flight are stalls
+    :param (int) n_stragglers: number of slowest stragglers to report
+    :return (dict): run summary, per second timeline, stragglers, stalls and thread utilization
+    """
+    from .serialize import iter_json_lines
+    calls = sorted(iter_json_lines(trace_fp), key=lambda call: call['start'])
+    if not calls:
+        return {'calls': 0}
+    run_start = calls[0]['start']
+    run_end = max(call['end'] for call in calls)
+    wall_time = run_end - run_start
+    busy_time = sum(call['end'] - call['start'] for call in calls)
+    return {
+        'calls': len(calls),
+        'wall_time_s': round(wall_time, 3),
+        'mean_concurrency': round(busy_time / wall_time, 2) if wall_time else float(len(calls)),
+        'max_concurrency': _max_concurrency(calls),
+        'outcomes': _count(call['outcome'] for call in calls),
+        'timeline': _timeline(calls, run_start, run_end),
+        'stragglers': _find_stragglers(calls, run_start, straggler_factor)[:n_stragglers],
+        'stalls': _find_stalls(calls, run_start, stall_seconds),
+        'thread_utilization': _thread_utilization(calls, wall_time),
+    }
+
+
+def _count(values):
+    counts = {}
+    for value in values:
+        counts[value] = counts.get(value, 0) + 1
+    return counts
+
+
+def _max_concurrency(calls):
+    events = sorted([(call['start'], 1) for call in calls] + [(call['end'], -1) for call in calls])
+    in_flight = max_in_flight = 0
+    for _, change in events:
+        in_flight += change
+        max_in_flight = max(max_in_flight, in_flight)
+    return max_in_flight
+
+
+def _timeline(calls, run_start, run_end):
+    """
+    :return (list): for every second of the run, the calls started and completed in it
+    and the mean number of calls in flight
+    """
+    n_seconds = int(run_end - run_start) + 1
+    timeline = [{'second': sec, 'started': 0, 'completed': 0, 'busy': 0.0} for sec in range(n_seconds)]
+    for call in calls:
+        start, end = call['start'] - run_start, call['end'] - run_start
+        timeline[int(start)]['started'] += 1
+        timeline[int(end)]['completed'] += 1
+        for sec in range(int(start), int(end) + 1):
+            timeline[sec]['busy'] += min(end, sec + 1) - max(start, sec)
+    for sec in timeline:
+        sec['in_flight'] = round(sec.pop('busy'), 2)
+    return timeline
+
+
+def _find_stragglers(calls, run_start, straggler_factor):
+    latencies = {}
+    for call in calls:
+        latencies.setdefault(call['operation'], []).append(call['end'] - call['start'])
+    medians = {operation: statistics.median(values) for operation, values in latencies.items()}
+    stragglers = []
+    for call in calls:
+        latency = call['end'] - call['start']
+        median = medians[call['operation']]
+        if median and latency > straggler_factor * median:
+            stragglers.append(dict(call, latency_s=round(latency, 3), median_s=round(median, 3),
+                                   start_offset_s=round(call['start'] - run_start, 3)))
+    return sorted(stragglers, key=lambda call: call['latency_s'], reverse=True)
+
+
+def _find_stalls(calls, run_start, stall_seconds):
+    """
+    :return (list): gaps during which no call was in flight, with the calls on either side
+    """
+    stalls = []
+    latest_end = calls[0]['end']
+    last_call = calls[0]
+    for call in calls[1:]:
+        gap = call['start'] - latest_end
+        if gap >= stall_seconds:
+            stalls.append({
+                'start_offset_s': round(latest_end - run_start, 3),
+                'duration_s': round(gap, 3),
+                'after': last_call['operation'],
+                'before': call['operation'],
+            })
+        if call['end'] > latest_end:
+            latest_end, last_call = call['end'], call
+    return stalls
+
+
+def _thread_utilization(calls, wall_time):
+    busy = {}
+    for call in calls:
+        busy[call['thread']] = busy.get(call['thread'], 0.0) + call['end'] - call['start']
+    return {thread: round(busy_time / wall_time, 3) if wall_time else 1.0
+            for thread, busy_time in sorted(busy.items())}
@@ -2,6 +2,8 @@
 """ Utilities
 
 """
+import collections
+import functools
 import os
 import time
 from decorator import decorator
@@ -15,19 +17,125 @@ def surface_hit_ids(action, *args, **kwargs):
     return action_name, hits
 
 
+class FrozenDict(dict):
+    """
+    A dict that cannot be modified after construction. It is still a dict, so it can be
+    passed straight to boto3 and json, and it is safe to share between threads.
+    """
+    def _immutable(self, *args, **kwargs):
+        raise TypeError(f'{type(self).__name__} is immutable')
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return type(self), (dict(self),)
+
+
+def freeze(obj):
+    """
+    Recursively converts dicts to FrozenDicts and lists to tuples
+    """
+    if isinstance(obj, dict):
+        return FrozenDict((key, freeze(val)) for key, val in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(val) for val in obj)
+    return obj
+
+
+def thaw(obj):
+    """
+    Recursively converts FrozenDicts (and other dicts) to dicts and tuples to lists
+    """
+    if isinstance(obj, dict):
+        return {key: thaw(val) for key, val in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [thaw(val) for val in obj]
+    return obj
+
+
 def recall_template_args(**kwargs):
     """
-    Collects all of the arguments expected by the interface template
-    : return (set): the expected arguments
+    Collects all of the arguments expected by the interface template, i.e. the variables
+    its Jinja AST leaves undeclared. The template is only parsed again when it is modified.
+    : return (frozenset): the expected arguments
     """
-    import re
     template_dir = kwargs['configuration']['interface_params']['template_dir']
     template_fn = kwargs['configuration']['interface_params']['template_file']
     template_fp = os.path.join(template_dir, template_fn)
+    return _find_template_args(template_fp, os.path.getmtime(template_fp))
+
+
+@functools.lru_cache(maxsize=32)
+def _find_template_args(template_fp, template_mtime):
+    import jinja2
+    import jinja2.meta
     with open(template_fp) as file:
         template_html = file.read()
-    template_args = re.findall(r'\{\{(.*?)\}', template_html)
-    return set(template_args)
+    env = jinja2.Environment()
+    template_ast = env.parse(template_html)
+    template_args = jinja2.meta.find_undeclared_variables(template_ast)
+    return frozenset(template_args.difference(env.globals))
+
+
+def reservoir_sample(iterable, n_samples, seed=None):
+    """
+    Samples uniformly from an iterable in a single pass, holding only the sample in memory
+    :param iterable: items to sample from, its length need not be known
+    :param (int) n_samples: sample size
+    :param seed: random seed
+    :return (list): sampled (index, item) pairs, in input order
+    """
+    import random
+    rng = random.Random(seed)
+    sample = []
+    for idx, item in enumerate(iterable):
+        if idx < n_samples:
+            sample.append((idx, item))
+        else:
+            replace_idx = rng.randrange(idx + 1)
+            if replace_idx < n_samples:
+                sample[replace_idx] = (idx, item)
+    return sorted(sample, key=lambda pair: pair[0])
+
+
+class IndexedView:
+    """
+    Lazy view of the items of a sequence at a list of indices
+    """
+    def __init__(self, data, indices):
+        self.data = data
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return IndexedView(self.data, self.indices[idx])
+        return self.data[self.indices[idx]]
+
+    def __iter__(self):
+        return (self.data[idx] for idx in self.indices)
+
+
+def bounded_imap(func, iterable, executor, max_pending):
+    """
+    Lazily maps func over iterable with executor, keeping at most max_pending calls
+    submitted ahead of the consumer
+    :param func: callable taking a single item
+    :param iterable: items, consumed only as results are taken
+    :param executor: concurrent.futures executor
+    :param (int) max_pending: maximum number of submitted but unconsumed calls
+    :return: generator of results, in input order
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
 
 def _create_timestamp():
@@ -1,21 +1,15 @@
 # -*- coding: utf-8 -*-
 """ AMT Tasks
 
+Each task imports the modules it needs, so listing tasks or running a single
+management action does not pay for boto3, pandas or matplotlib unless it uses them.
 """
 from invoke import task
-from crowdsourcery import (
-    creation,
-    config,
-    management,
-    storage,
-    serialize,
-    workers,
-    viz
-)
 
 
 @task
 def _set_config(ctx):
+    from crowdsourcery import config
     config_file = ctx.get('task_config_fp', None)
     config_fp_used = config.set_input_file_path(config_file)
     from crowdsourcery.log import logger
@@ -24,12 +18,13 @@ def _set_config(ctx):
 
 @task(pre=[_set_config])
 def preview_interface(ctx, input_data_fp, data_idx=None, open_in_browser=False):
+    from crowdsourcery import creation, serialize
     data = serialize.load_input_data(input_data_fp)
     if data_idx:
-        datum = data[data_idx]
+        datum = data[int(data_idx)]
     else:
-        import random
-        datum = random.choice(data)
+        from crowdsourcery.utils import reservoir_sample
+        [(_, datum)] = reservoir_sample(data, 1)
     out_fp = creation.preview_interface(datum)
     if open_in_browser:
         import subprocess
@@ -37,21 +32,36 @@ def preview_interface(ctx, input_data_fp, data_idx=None, open_in_browser=False):
 
 
 @task(pre=[_set_config])
-def create_hits(ctx, input_data_fp):
+def preview_batch(ctx, input_data_fp, n_samples=None, seed=None, open_in_browser=False):
+    from crowdsourcery import creation, serialize
     data = serialize.load_input_data(input_data_fp)
-    creation.create_hits(data[:10])
+    n_samples = int(n_samples) if n_samples else None
+    index_fp = creation.preview_batch(data, n_samples=n_samples, seed=seed)
+    if open_in_browser:
+        import subprocess
+        subprocess.call(['open', index_fp])
+
+
+@task(pre=[_set_config])
+def create_hits(ctx, input_data_fp, resume=False):
+    from crowdsourcery import creation, serialize
+    data = serialize.load_input_data(input_data_fp)
+    creation.create_hits(data[:10], resume=resume)
 
 
 @task(pre=[_set_config])
 def create_hit_type(ctx):
+    from crowdsourcery import creation
     creation.create_hit_type()
 
 
 @task(pre=[_set_config])
 def get_hit_status(ctx, hit_group_fp, plot=False):
+    from crowdsourcery import management, serialize
     hits = serialize.deserialize_result(hit_group_fp)
     hit_stats = management.get_hit_statuses(hits)
     if plot:
+        from crowdsourcery import viz
         viz.hit_status_counts(hit_stats)
     else:
         print(hit_stats.value_counts())
@@ -59,6 +69,7 @@ def get_hit_status(ctx, hit_group_fp, plot=False):
 
 @task(pre=[_set_config])
 def get_assignments(ctx, hit_group_fp, extract=False):
+    from crowdsourcery import management, serialize
     hits = serialize.deserialize_result(hit_group_fp)
     if extract:
         assignment_results = management.get_and_extract_results(hits)
@@ -70,18 +81,21 @@ def get_assignments(ctx, hit_group_fp, extract=False):
 
 @task(pre=[_set_config])
 def approve_assignments(ctx, assignment_group_fp):
+    from crowdsourcery import management, serialize
     assignments = serialize.deserialize_result(assignment_group_fp)
     management.approve_assignments(assignments)
 
 
 @task(pre=[_set_config])
 def approve_hits(ctx, hit_group_fp):
+    from crowdsourcery import management, serialize
     hits = serialize.deserialize_result(hit_group_fp)
     management.approve_hits(hits)
 
 
 @task(pre=[_set_config])
 def get_all_hits(ctx, out_file=None):
+    from crowdsourcery import management, serialize
     if not out_file:
         out_file = './all_profile_hits.json'
     all_hits = management.get_all_hits()
@@ -90,40 +104,57 @@ def get_all_hits(ctx, out_file=None):
 
 @task(pre=[_set_config])
 def change_hit_review_status(ctx, hit_group_fp, revert=False):
+    from crowdsourcery import management, serialize
     hits = serialize.deserialize_result(hit_group_fp)
     management.change_hit_review_status(hits, revert=revert)
 
 
 @task(pre=[_set_config])
 def expire_hits(ctx, hit_group_fp):
+    from crowdsourcery import management, serialize
     hits = serialize.deserialize_result(hit_group_fp)
     management.expire_hits(hits)
 
 
 @task(pre=[_set_config])
 def delete_hits(ctx, hit_group_fp):
+    from crowdsourcery import management, serialize
     hits = serialize.deserialize_result(hit_group_fp)
     management.delete_hits(hits)
 
 
 @task(pre=[_set_config])
 def force_delete_hits(ctx, hit_group_fp):
+    from crowdsourcery import management, serialize
     hits = serialize.deserialize_result(hit_group_fp)
     management.force_delete_hits(hits)
 
 
+@task(pre=[_set_config])
+def retry_failed(ctx, failed_fp):
+    from crowdsourcery import management
+    management.retry_failed_requests(failed_fp)
+
+
 @task(pre=[_set_config])
 def upload_to_s3(ctx, file_path):
+    from crowdsourcery import storage
     storage.upload_object(file_path)
 
 
 @task(pre=[_set_config])
 def list_working_s3_folder(ctx, display_metadata=False, **kwargs):
+    from crowdsourcery import storage
     storage.list_working_folder(display_metadata)
 
 
 @task(pre=[_set_config])
 def compute_worker_avg_rates(ctx, hit_group_fp=None, plot=False, target_rate=10.0):
+    from crowdsourcery import (
+        management,
+        serialize,
+        workers
+    )
     if hit_group_fp:
         hits = serialize.deserialize_result(hit_group_fp)
     else:
@@ -142,6 +173,73 @@ def compute_worker_avg_rates(ctx, hit_group_fp=None, plot=False, target_rate=10.
     print(', '.join(out_message))
     print('-'.join([''] * 100))
     if plot:
+        from crowdsourcery import viz
         viz.worker_rate_hist(avg_rates, target_rate)
     else:
         print(avg_rates)
+
+
+@task(pre=[_set_config])
+def query_store(ctx, table='hits', status=None, batch_id=None, worker_id=None, out_file=None):
+    from crowdsourcery import serialize, store
+    if table == 'hits':
+        records = store.query_hits(status=status, batch_id=batch_id)
+    elif table == 'assignments':
+        records = store.query_assignments(status=status, batch_id=batch_id, worker_id=worker_id)
+    else:
+        print(f'{table} is not a stored table, use hits or assignments')
+        return
+    print(f'{len(records)} {table} found')
+    print(store.status_counts(table, batch_id=batch_id))
+    if out_file:
+        serialize.serialize_result(records, 'json', out_file)
+
+
+@task
+def analyze_trace(ctx, trace_fp, straggler_factor=5.0, stall_seconds=2.0):
+    from crowdsourcery import trace
+    report = trace.analyze_trace(trace_fp, float(straggler_factor), float(stall_seconds))
+    if not report['calls']:
+        print('empty trace')
+        return
+    print(f"{report['calls']} calls in {report['wall_time_s']}s, "
+          f"concurrency mean {report['mean_concurrency']} max {report['max_concurrency']}")
+    print('outcomes:', report['outcomes'])
+    print('calls in flight per second:')
+    print(' '.join(f"{sec['in_flight']:.1f}" for sec in report['timeline']))
+    for stall in report['stalls']:
+        print(f"stall of {stall['duration_s']}s at {stall['start_offset_s']}s "
+              f"between {stall['after']} and {stall['before']}")
+    for call in report['stragglers']:
+        print(f"straggler {call['operation']} {call['HITId'] or ''} took {call['latency_s']}s "
+              f"(median {call['median_s']}s) at {call['start_offset_s']}s on {call['thread']}")
+    idle = {thread: util for thread, util in report['thread_utilization'].items() if util < 0.5}
+    if idle:
+        print('threads busy less than half the run:', idle)
+
+
+@task
+def benchmark_imports(ctx, module=None):
+    from crowdsourcery import benchmarks
+    modules = [module] if module else benchmarks.PACKAGE_MODULES
+    for module_name, total_ms, dependencies in benchmarks.benchmark_imports(modules):
+        if total_ms is None:
+            print(f'{module_name:<28} {"import failed":>10}')
+            continue
+        heaviest = ', '.join(f'{dep} {dep_ms:.0f}ms' for dep, dep_ms in dependencies)
+        print(f'{module_name:<28} {total_ms:>8.1f}ms   {heaviest}')
+
+
+@task
+def benchmark_compression(ctx, n_records=2000):
+    from crowdsourcery import benchmarks
+    n_records = int(n_records)
+    payloads = {
+        'hits': benchmarks.sample_hits(n_records),
+        'assignments': benchmarks.sample_assignments(n_records),
+    }
+    print(f"{'payload':<12} {'format':<7} {'codec':<6} {'level':>5} {'size_kb':>9} "
+          f"{'ratio':>6} {'write_s':>8} {'read_s':>8}")
+    for res in benchmarks.benchmark_compression(payloads):
+        print(f"{res['payload']:<12} {res['format']:<7} {res['codec']:<6} {str(res['level'] or ''):>5} "
+              f"{res['size_kb']:>9} {res['ratio']:>6} {res['write_s']:>8} {res['read_s']:>8}")
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""Tests for result serialization
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from crowdsourcery.serialize import (
+    _dump_jsonl,
+    _load_jsonl
+)
+
+
+class JsonLinesTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        self.file_name = os.path.join(self.work_dir, 'result')
+
+    def test_list_round_trip(self):
+        records = [{'HITId': 'h1'}, {'HITId': 'h2'}]
+        for compress in (False, True):
+            _dump_jsonl(records, self.file_name, compress)
+            self.assertEqual(_load_jsonl(self.file_name), records)
+
+    def test_mapping_round_trip(self):
+        results = {'g1': {'labels': ['cat']}, 'g2': {'labels': []}}
+        for compress in (False, True):
+            _dump_jsonl(results, self.file_name, compress)
+            self.assertEqual(_load_jsonl(self.file_name), results)
+            self.assertEqual(dict(_load_jsonl(self.file_name, lazy=True)), results)
+
+    def test_empty_mapping_round_trip(self):
+        _dump_jsonl({}, self.file_name, False)
+        self.assertEqual(_load_jsonl(self.file_name), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
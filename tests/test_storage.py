@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""Tests for S3 storage and hosted ExternalQuestion pages, run against LocalBucketClient
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import urllib.parse
+import urllib.request
+
+import yaml
+
+from crowdsourcery.config import load_configuration
+from crowdsourcery.html_hit import (
+    BaseHitParams,
+    create_external_hit_params,
+    render_external_page
+)
+from crowdsourcery.storage import (
+    LocalBucketClient,
+    _create_s3_client,
+    build_object_path,
+    download_object,
+    list_objects,
+    upload_object
+)
+
+_TEMPLATE = """\
+<html>
+<head><title>{{ title }}</title></head>
+<body>
+<img src="{{ image.url }}">
+{% for label in labels %}<label>{{ label }}</label>{% endfor %}
+</body>
+</html>
+"""
+
+
+class StorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+        template_dir = os.path.join(self.work_dir, 'hit_templates')
+        os.makedirs(template_dir)
+        with open(os.path.join(template_dir, 'task.html'), 'w') as file:
+            file.write(_TEMPLATE)
+        settings = {
+            'experiment_params': {
+                'batch_id': 'batch',
+                'project_name': 'project',
+                'debug_level': 'info',
+                's3_storage_location': 'bucket/hits',
+                'local_storage_dir': os.path.join(self.work_dir, 'local_s3'),
+            },
+            'interface_params': {
+                'template_dir': template_dir,
+                'template_file': 'task.html',
+                'question_type': 'external',
+            },
+            'serialization_params': {
+                'output_dir_base': os.path.join(self.work_dir, 'amt_output'),
+            },
+        }
+        config_fp = os.path.join(self.work_dir, 'config.yml')
+        with open(config_fp, 'w') as file:
+            yaml.safe_dump(settings, file)
+        self.configuration = load_configuration(config_fp)
+
+    def _write(self, file_name, contents):
+        file_path = os.path.join(self.work_dir, file_name)
+        with open(file_path, 'w') as file:
+            file.write(contents)
+        return file_path
+
+
+class LocalBucketClientTest(StorageTestCase):
+    def test_selected_by_local_storage_dir(self):
+        self.assertIsInstance(_create_s3_client(configuration=self.configuration), LocalBucketClient)
+
+    def test_upload_file_and_get_object(self):
+        client = LocalBucketClient(os.path.join(self.work_dir, 'local_s3'))
+        client.upload_file(self._write('page.html', '<p>hi</p>'), 'bucket', 'a/b/page.html',
+                           ExtraArgs={'ContentType': 'text/html'})
+        self.assertEqual(client.get_object(Bucket='bucket', Key='a/b/page.html')['Body'].read(), b'<p>hi</p>')
+
+    def test_upload_fileobj_and_list_objects(self):
+        client = LocalBucketClient(os.path.join(self.work_dir, 'local_s3'))
+        client.upload_fileobj(io.BytesIO(b'1'), 'bucket', 'a/one.json')
+        client.upload_fileobj(io.BytesIO(b'22'), 'bucket', 'b/two.json')
+        listed = client.list_objects_v2(Bucket='bucket', Prefix='a/')['Contents']
+        self.assertEqual([(obj['Key'], obj['Size']) for obj in listed], [('a/one.json', 1)])
+
+    def test_object_url(self):
+        client = LocalBucketClient(os.path.join(self.work_dir, 'local_s3'))
+        client.upload_fileobj(io.BytesIO(b'<p>hi</p>'), 'bucket', 'page.html')
+        with urllib.request.urlopen(client.object_url('bucket', 'page.html')) as page:
+            self.assertEqual(page.read(), b'<p>hi</p>')
+
+
+class UploadObjectTest(StorageTestCase):
+    def test_upload_file(self):
+        url = upload_object(self._write('page.html', '<p>hi</p>'), configuration=self.configuration)
+        _, _, obj_key = build_object_path('page.html', configuration=self.configuration)
+        self.assertEqual(obj_key, 'hits/project/batch/page.html')
+        with urllib.request.urlopen(url) as page:
+            self.assertEqual(page.read(), b'<p>hi</p>')
+        listed = list(list_objects('bucket', 'hits/project/batch', configuration=self.configuration))
+        self.assertEqual([obj['Key'] for obj in listed], [obj_key])
+
+    def test_upload_and_download_json(self):
+        obj = {'globalID': 'g1', 'labels': ['cat', 'dog']}
+        upload_object(os.path.join(self.work_dir, 'obj.json'), obj=obj, configuration=self.configuration)
+        self.assertEqual(download_object('obj.json', configuration=self.configuration), obj)
+
+
+class ExternalPageTest(StorageTestCase):
+    def test_renders_without_datum(self):
+        page_html = render_external_page(configuration=self.configuration)
+        self.assertIn('<img src="">', page_html)
+        self.assertNotIn('<label>', page_html)
+
+    def test_renders_filters_without_datum(self):
+        self._write('hit_templates/task.html', '<script>var item = {{ item|tojson }};</script>'
+                                               '<p>{{ count|int + 1 }} of {{ total * 2 }}</p>')
+        page_html = render_external_page(configuration=self.configuration)
+        self.assertIn('var item = null;', page_html)
+        self.assertIn('<p>1 of </p>', page_html)
+
+    def test_template_needing_datum_raises(self):
+        self._write('hit_templates/task.html', '<p>{{ score|round }}</p>')
+        with self.assertRaisesRegex(ValueError, 'task.html cannot be rendered without a datum'):
+            render_external_page(configuration=self.configuration)
+
+    def test_loader_script_runs_before_body(self):
+        page_html = render_external_page(configuration=self.configuration)
+        self.assertLess(page_html.index('window.templateArgs'), page_html.index('<title>'))
+
+    def test_hosted_page_url_carries_datum(self):
+        page_url = upload_object(self._write('page.html', render_external_page(configuration=self.configuration)),
+                                 configuration=self.configuration)
+        template_args = {'title': 'cats', 'image': {'url': 'https://example.com/1.jpg'}, 'labels': ['a', 'b']}
+        hit_params = create_external_hit_params(BaseHitParams({'MaxAssignments': 3}, 600), page_url, template_args)
+        self.assertEqual(hit_params['MaxAssignments'], 3)
+        question_url = hit_params['Question'].split('<ExternalURL>')[1].split('</ExternalURL>')[0]
+        question_url = question_url.replace('&amp;', '&')
+        hosted_url, query = question_url.split('?')
+        self.assertEqual(hosted_url, page_url)
+        query_args = {arg: json.loads(val) for arg, val in urllib.parse.parse_qsl(query)}
+        self.assertEqual(query_args, template_args)
+
+
+if __name__ == '__main__':
+    unittest.main()